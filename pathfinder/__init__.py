@@ -21,9 +21,11 @@ from __future__ import absolute_import
 import BaseHTTPServer
 import collections
 import Cookie
+import hashlib
 import logging
 import os
 import re
+import stat
 import sys
 import traceback
 import urlparse
@@ -40,7 +42,8 @@ except ImportError:
     gevent = None
 
 
-__all__ = ["ALL_METHODS", "Finder", "Request", "Response"]
+__all__ = ["ALL_METHODS", "Finder", "Request", "Response", "StaticResponse",
+        "FileResponse"]
 
 log = logging.getLogger("pathfinder")
 
@@ -53,10 +56,29 @@ ALL_METHODS = ["OPTIONS", "GET", "HEAD", "POST",
 class Finder(object):
     """The router of HTTP requests
 
-    Create it with a list of three-tuples for route matching. the first item
-    should be a regular expression string, the second a handler (more on this
-    in a bit), and the third a list of strings of HTTP methods (the special
-    value pathfinder.ALL_METHODS is a list of all the methods in rfc 2616).
+    Create it with a list of tuples for route matching. the first item should
+    be a regular expression string, and the second either a handler (more on
+    this in a bit) or a dictionary mapping HTTP methods to handlers. An
+    optional third item is a dictionary of route options:
+
+    - ``multipart_limits``: overrides for :attr:`Request.MULTIPART_LIMITS`
+      when parsing a multipart request body on this route
+    - ``compression``: a :class:`pathfinder.compress.Compressor` for the
+      responses on this route, or None to turn off the finder's
+    - ``conditional``: whether to answer GET and HEAD requests on this route
+      with a 304 when their If-None-Match has the response's ETag. responses
+      with a string body and no ETag get one from a hash of the body
+    - ``etag``: a function called before the handler with the same
+      arguments, returning the current ETag of the resource (or None). if it
+      matches the request's If-None-Match the handler is skipped and a 304
+      sent, otherwise the response gets it as its ETag
+    - ``cache``: a :class:`pathfinder.cache.ResponseCache` to serve GET
+      requests from, and store their responses in
+    - ``coalesce``: a :class:`pathfinder.coalesce.Coalescer` so that
+      concurrent identical GET requests share one call of the handler
+    - ``buffer_size``: join the small strings of iterable response bodies
+      into chunks of at least this many bytes before they are sent, or None
+      to send each as it comes (for streams that must not be held back)
 
     Each request will have the path checked against all regular expressions
     with the correct HTTP method associated, and the handler of the first
@@ -70,46 +92,121 @@ class Finder(object):
     Handlers can also be functions in which case they will be called with the
     request as the first argument, and any un-named and named capture groups
     from the regex as further positional and keyword arguments, respectively.
+
+    HEAD requests go to the GET handler unless a HEAD handler is given, and
+    only the headers of the response are sent: its body is never iterated
+    over. So a HEAD handler can be a cheaper version of the GET one which
+    leaves out the body, setting Content-Length itself.
+
+    Response bodies which are lists or tuples of strings get a
+    Content-Length header (if they haven't one) from the sum of their
+    lengths.
+
+    ``multipart_limits`` sets overrides of :attr:`Request.MULTIPART_LIMITS`
+    for every request routed through this finder, ``compression`` a
+    :class:`pathfinder.compress.Compressor` for all of its responses, and
+    ``conditional`` and ``buffer_size`` the defaults for the route options
+    of those names. Sub-finders and route options can in turn override
+    these.
     """
-    def __init__(self, urlmap):
+    def __init__(self, urlmap, multipart_limits=None, compression=None,
+            conditional=None, buffer_size=None):
         self._map = {}
-
-        for regex, mapping in urlmap:
+        self.multipart_limits = multipart_limits
+        self.compression = compression
+        self.conditional = conditional
+        self.buffer_size = buffer_size
+
+        for route in urlmap:
+            regex, mapping = route[:2]
+            options = route[2] if len(route) > 2 else {}
             regex = re.compile(regex)
             if isinstance(mapping, Finder) or hasattr(mapping, '__call__'):
                 for verb in ALL_METHODS:
                     self._map.setdefault(verb.lower(), []).append(
-                            (regex, mapping))
+                            (regex, mapping, options))
             else:
-                for verb, handler in mapping.iteritems():
-                    self._map.setdefault(verb.lower(), []).append(
-                            (regex, handler))
+                verbs = dict((verb.lower(), handler)
+                        for verb, handler in mapping.iteritems())
+                # HEAD is handled by the GET handler, unless it has its own
+                if 'get' in verbs and 'head' not in verbs:
+                    verbs['head'] = verbs['get']
+                for verb, handler in verbs.iteritems():
+                    self._map.setdefault(verb, []).append(
+                            (regex, handler, options))
 
     def _resolve(self, method, path):
-        for regex, handler in self._map.get(method.lower(), ()):
+        for regex, handler, options in self._map.get(method.lower(), ()):
             match = regex.match(path)
             if match:
                 if isinstance(handler, Finder):
                     remaining = path[:match.start()] + path[match.end():]
-                    return handler, (), {}, remaining
+                    return handler, (), {}, remaining, options
                 kwargs = match.groupdict()
                 args = () if kwargs else match.groups()
-                return handler, args, kwargs, ""
-        return None, (), {}, ""
+                return handler, args, kwargs, "", options
+        return None, (), {}, "", {}
 
     def _handle(self, path, request):
         method = request.method
 
-        handler, args, kwargs, remaining = self._resolve(method, path)
+        handler, args, kwargs, remaining, options = self._resolve(method, path)
         if not handler:
             # no routes matched, bail with 404
             return self._on_404(request)
 
+        if self.multipart_limits:
+            request.multipart_limits.update(self.multipart_limits)
+        if 'multipart_limits' in options:
+            request.multipart_limits.update(options['multipart_limits'])
+        if self.compression is not None:
+            request.compression = self.compression
+        if 'compression' in options:
+            request.compression = options['compression']
+        if self.conditional is not None:
+            request.conditional = self.conditional
+        if 'conditional' in options:
+            request.conditional = options['conditional']
+        if self.buffer_size is not None:
+            request.buffer_size = self.buffer_size
+        if 'buffer_size' in options:
+            request.buffer_size = options['buffer_size']
+
         if isinstance(handler, Finder):
             return handler._handle(remaining, request)
 
+        cache = options.get('cache')
+        if cache is not None and method in ('GET', 'HEAD'):
+            key = cache.key(request)
+            if key is not None:
+                response = cache.get(key)
+                if response is not None:
+                    return response
+                if method == 'GET':
+                    request._response_cache = cache, key
+
+        coalescer = options.get('coalesce')
+        if coalescer is not None and method == 'GET':
+            key = coalescer.key(request)
+            if key is not None:
+                return coalescer.call(key, lambda: self._shareable(request,
+                    self._call(request, handler, args, kwargs, options)))
+
+        return self._call(request, handler, args, kwargs, options)
+
+    def _call(self, request, handler, args, kwargs, options):
         try:
+            etag = None
+            validator = options.get('etag')
+            if validator is not None and request.method in ('GET', 'HEAD'):
+                etag = validator(request, *args, **kwargs)
+                if etag is not None and _etag_matches(request, etag):
+                    return _not_modified([('ETag', etag)])
+
             response = handler(request, *args, **kwargs)
+        except multipart.MultipartLimitError, exc:
+            log.warn("multipart limit hit on %s: %s" % (request.path, exc))
+            return Response("", code=413, headers=[("Content-Length", "0")])
         except Exception:
             triple = sys.exc_info()
             log.error("handler raised:\n%s" %
@@ -118,23 +215,23 @@ class Finder(object):
 
         # enable string return values
         if isinstance(response, str):
-            return Response(response,
+            response = Response(response,
                     headers=[("Content-Length", str(len(response)))])
 
         # allow unicode responses in the same way, encoding to UTF-8
-        if isinstance(response, unicode):
+        elif isinstance(response, unicode):
             try:
                 response = response.encode('utf8')
             except UnicodeEncodeError:
                 log.error(
                     "unicode returned from handler can not be encoded UTF-8")
                 return self._on_500(request, sys.exc_info())
-            return Response(response, headers=[
+            response = Response(response, headers=[
                     ('Content-Length', str(len(response))),
                     ('Content-Encoding', 'UTF-8')])
 
         # bail out on any other return type
-        if not isinstance(response, Response):
+        elif not isinstance(response, Response):
             log.error("handler didn't return a Response but %r" % response)
             # this is dumb, but how *should* one get an exception triple?
             try:
@@ -142,6 +239,58 @@ class Finder(object):
             except TypeError:
                 return self._on_500(request, sys.exc_info())
 
+        if etag is not None and not response.has_header('etag'):
+            response.add_header('ETag', etag)
+
+        return response
+
+    def _shareable(self, request, response):
+        # a StaticResponse of the finalized ``response`` to hand to other
+        # requests, if it can be shared. only 200s are, as anything else
+        # (like a 304 from the etag validator) may be particular to it
+        if response is NoResponse or isinstance(response, StaticResponse) or \
+                response.code != 200 or \
+                not isinstance(response.content, str) or response.cookies or \
+                response.has_header('set-cookie'):
+            return response
+        try:
+            response.finalize(request)
+        except Exception:
+            return self._on_500(request, sys.exc_info())
+        return StaticResponse(
+                response.content, response.code, response.headerlist)
+
+    def _finish(self, request, response):
+        # everything between the handler and sending the response
+        if not isinstance(response, StaticResponse):
+            try:
+                response.finalize(request)
+            except Exception:
+                return self._on_500(request, sys.exc_info())
+
+        if request._response_cache is not None:
+            cache, key = request._response_cache
+            response = cache.store(key, request.path, response)
+
+        if request.conditional and response.code == 200 and \
+                request.method in ('GET', 'HEAD'):
+            etag = response.get_header('etag')
+            if etag is None and isinstance(response.content, str):
+                etag = '"%s"' % hashlib.md5(response.content).hexdigest()
+                response.add_header('ETag', etag)
+            if etag is not None and _etag_matches(request, etag):
+                return _not_modified_for(request, response)
+
+        if request.compression is not None:
+            response = request.compression.compress(request, response)
+
+        if request.method == 'HEAD':
+            response = _headers_only(response)
+
+        if hasattr(response.content, '__iter__') and \
+                not isinstance(response, FileResponse):
+            _prepare_chunks(response, request.buffer_size)
+
         return response
 
     if gevent:
@@ -160,17 +309,25 @@ class Finder(object):
             if response is NoResponse:
                 return
 
-            try:
-                response.finalize(request)
-            except Exception:
-                response = self._on_500(request, sys.exc_info())
+            response = self._finish(request, response)
+            if isinstance(response, StaticResponse):
+                # serialized up front
+                status_text = response.reason
+            else:
+                status_text = HTTP_CODE_DATA[response.code][0]
 
-            status_text = HTTP_CODE_DATA[response.code][0]
             try:
-                for name, value in response.headers.iteritems():
+                for name, value in response.headerlist:
                     grequest.add_output_header(name, value)
-                grequest.send_reply(
-                        response.code, status_text, response.content)
+                if isinstance(response.content, str):
+                    grequest.send_reply(
+                            response.code, status_text, response.content)
+                else:
+                    # stream iterable bodies rather than joining them up
+                    grequest.send_reply_start(response.code, status_text)
+                    for chunk in response.content:
+                        grequest.send_reply_chunk(chunk)
+                    grequest.send_reply_end()
             except gevent.core.HttpRequestDeleted:
                 pass
 
@@ -181,10 +338,14 @@ class Finder(object):
         interface to pathfinder.
         """
         headers = []
+        names = util.environ_header_names
         for key, value in environ.iteritems():
-            if not key.startswith("HTTP_"):
+            if key in names:
+                key = names[key]
+            elif key.startswith("HTTP_"):
+                key = key[5:].replace('_', '-').lower()
+            else:
                 continue
-            key = key[5:].replace('_', '-').lower()
             for val in value.split(","):
                 headers.append((key, val))
 
@@ -197,14 +358,22 @@ class Finder(object):
             # this WSGI handler doesn't support NoResponse
             response = Response("Server Error", code=500)
 
-        try:
-            response.finalize(request)
-        except Exception:
-            response = self._on_500(request, sys.exc_info())
+        response = self._finish(request, response)
+        if isinstance(response, StaticResponse):
+            # serialized up front. the header list is copied as servers are
+            # allowed to add to it
+            start_response(response.status, list(response.headerlist))
+            return [response.content]
 
         status_text = HTTP_CODE_DATA[response.code][0]
         start_response("%d %s" % (response.code, status_text),
-                response.headers.items())
+                response.headerlist)
+
+        if isinstance(response, FileResponse) and \
+                response.length is None and 'wsgi.file_wrapper' in environ:
+            # let the server send the file however it does best (sendfile)
+            return environ['wsgi.file_wrapper'](
+                    response.file, response.BLOCKSIZE)
 
         if not hasattr(response.content, "__iter__"):
             return [response.content]
@@ -281,10 +450,33 @@ class Request(object):
     """
     CHUNKSIZE = 8192
 
+    UPLOAD_DIR = None
+    "where to spool large multipart parts (None for the system temp dir)"
+
+    MULTIPART_LIMITS = {
+        'disk_limit': 2**32,
+        'mem_limit': 2**28,
+        'memfile_limit': 2**28,
+        'budget': None,
+    }
+    """default limits for parsing multipart bodies
+
+    - ``disk_limit``: total bytes of parts spooled to disk
+    - ``mem_limit``: total bytes of parts held in memory
+    - ``memfile_limit``: size at which a part is moved from memory to disk
+    - ``budget``: a :class:`pathfinder.multipart.MemoryBudget` shared with
+      the other requests' parsers
+
+    exceeding any of these produces a 413 response
+    """
+
     def __init__(self, method, path, headers, bodyfile):
         self._bodyfile = bodyfile
         self._bodystring = None
         self._post = None
+        self._params = None
+        self._part_sinks = {}
+        self._response_cache = None
         self._started_reading = False
         self._rbuf = StringIO()
 
@@ -299,7 +491,8 @@ class Request(object):
         self.query_string = parsed.query
         "the raw query string"
 
-        self.query_params = util.OrderedMultiDict(urlparse.parse_qsl(parsed.query))
+        self.query_params = util.OrderedMultiDict.fromitems(
+                urlparse.parse_qsl(parsed.query))
         "decoded parameters from the querystring"
 
         headers, ctopts, cdopts = _parse_headers(headers)
@@ -307,11 +500,26 @@ class Request(object):
         self._cdopts = cdopts
 
         self.headers = headers
-        "Request headers"
+        "Request headers (an immutable, case-insensitive multi-dict)"
 
         self.cookies = _parse_cookies(self.headers.getall('cookie'))
         "Cookies in the request"
 
+        self.multipart_limits = {}
+        "overrides of MULTIPART_LIMITS, as configured on the Finder and route"
+
+        self.part_digests = []
+        "hashlib algorithms to compute over each multipart part while parsing"
+
+        self.compression = None
+        "the Compressor for the response, as set on the Finder and route"
+
+        self.conditional = False
+        "whether to send 304s for matching ETags, per the Finder and route"
+
+        self.buffer_size = None
+        "the size to buffer iterable response bodies up to, if any"
+
         self.parts = self._parse_parts()
         "Sections of a multipart request body"
 
@@ -320,14 +528,27 @@ class Request(object):
             boundary = self.content_type_opts.get('boundary', '')
             clength = int(self.headers.get('content-length', -1))
             charset = self.content_type_opts.get('charset', 'utf8')
+            limits = dict(self.MULTIPART_LIMITS, **self.multipart_limits)
             parser = multipart.MultipartParser(self, boundary, clength,
-                    disk_limit=2**32, mem_limit=2**28, memfile_limit=2**28,
-                    charset=charset)
+                    charset=charset, sinks=self._part_sinks,
+                    tmpdir=self.UPLOAD_DIR, digests=self.part_digests,
+                    **limits)
             for part in parser:
                 headers, ctopts, cdopts = _parse_headers(part.headerlist)
                 yield multipartpart(
                         headers, part.size, part.name, part.filename,
-                        part.charset, ctopts, cdopts, part.value)
+                        part.charset, ctopts, cdopts, _partbody(part))
+
+    def add_part_sink(self, name, sink):
+        """Stream the body of multipart fields named ``name`` into ``sink``
+
+        ``sink`` may be a writable file-like object, or a callable which will
+        be called with each chunk of data as it is parsed (a hash object's
+        ``update``, a socket's ``sendall``). These parts aren't buffered, so
+        their ``body`` will be None. Add sinks before iterating over
+        :attr:`parts`.
+        """
+        self._part_sinks[name] = getattr(sink, 'write', sink)
 
     @property
     def body_params(self):
@@ -359,10 +580,15 @@ class Request(object):
 
     @property
     def params(self):
-        "parameters from the querystring and request body combined"
-        params = self.query_params.copy()
-        params.update(self.body_params)
-        return params
+        """parameters from the querystring and request body combined
+
+        this is a read-only :class:`pathfinder.util.ChainedMultiDict` over
+        :attr:`query_params` and :attr:`body_params`
+        """
+        if self._params is None:
+            self._params = util.ChainedMultiDict(
+                    self.query_params, self.body_params)
+        return self._params
 
     def read(self, size=None):
         "Read some or all of the request body directly"
@@ -408,12 +634,69 @@ class Response(object):
         self.code = code
         "integer HTTP status code (defaults to 200)"
 
-        self.headers = util.CaseInsensitiveOrderedMultiDict(headers or {})
-        "dictionary of headers for the response"
+        self.headers = headers or ()
 
         self.cookies = Cookie.SimpleCookie()
         "Cookies to send in the response"
 
+    @property
+    def headers(self):
+        """dictionary of headers for the response
+
+        headers are kept in a plain list of pairs until this is first used,
+        when they are moved into a
+        :class:`pathfinder.util.CaseInsensitiveOrderedMultiDict`. so where
+        headers only need adding, :meth:`add_header` is cheaper.
+        """
+        if self._headers is None:
+            self._headers = util.CaseInsensitiveOrderedMultiDict.fromitems(
+                    self._headerlist)
+            self._headerlist = None
+        return self._headers
+
+    @headers.setter
+    def headers(self, headers):
+        if isinstance(headers, collections.Mapping):
+            headers = headers.iteritems()
+        self._headerlist = list(headers)
+        self._headers = None
+
+    @property
+    def headerlist(self):
+        "the headers as a list of (name, value) pairs, in order"
+        if self._headers is None:
+            return self._headerlist
+        return self._headers.items()
+
+    def add_header(self, name, value):
+        "add a header (alongside any others with the same name)"
+        if self._headers is None:
+            self._headerlist.append((name, value))
+        else:
+            self._headers[name] = value
+
+    def has_header(self, name):
+        "check case-insensitively for the presence of a header"
+        if self._headers is not None:
+            return name in self._headers
+        names = util.lower_header_names
+        name = names[name] if name in names else name.lower()
+        for key, value in self._headerlist:
+            if (names[key] if key in names else key.lower()) == name:
+                return True
+        return False
+
+    def get_header(self, name, default=None):
+        "get the last value of a header, matching the name case-insensitively"
+        if self._headers is not None:
+            return self._headers.get(name, default)
+        names = util.lower_header_names
+        name = names[name] if name in names else name.lower()
+        for key, value in reversed(self._headerlist):
+            if (names[key] if key in names else key.lower()) == name:
+                return value
+        return default
+
     def finalize(self, request):
         """finalizer for responses
 
@@ -421,24 +704,272 @@ class Response(object):
         finished (and remember to call the super)
         """
         # place output headers into the set-cookie header(s)
-        self.headers.update(('Set-Cookie', m.output(header='')[1:])
-                for m in self.cookies.values())
+        for morsel in self.cookies.values():
+            self.add_header('Set-Cookie', morsel.output(header='')[1:])
 
         # add a content-type
-        if self.default_content_type and 'content-type' not in self.headers:
-            self.headers['Content-Type'] = self.default_content_type
+        if self.default_content_type and not self.has_header('content-type'):
+            self.add_header('Content-Type', self.default_content_type)
+
+
+class StaticResponse(Response):
+    """A constant response, serialized once and reused for every request
+
+    For handlers that produce the same output every time: create one of
+    these up front and return that same instance from each call, or put it
+    in a :class:`Finder` urlmap in place of the handler. Its status line,
+    header list and body are prepared at creation (filling in Content-Length,
+    the default Content-Type and an ETag), and :meth:`Finder.wsgi` and
+    :meth:`Finder.gevent_http_handle` send them as-is without calling
+    :meth:`finalize`.
+
+    Since it is shared between requests it is immutable: :attr:`headers` is a
+    :class:`pathfinder.util.FrozenCaseInsensitiveMultiDict` which can't be
+    replaced, and cookies have to be provided as Set-Cookie headers
+    (:attr:`cookies` is always empty).
+    """
+    # shadow Response's property, so that it can be set once in __init__
+    headerlist = None
+
+    @property
+    def headers(self):
+        "the response headers (read-only)"
+        return self._headers
+
+    @property
+    def cookies(self):
+        "always empty and read-only, use Set-Cookie headers instead"
+        return _NO_COOKIES
+
+    def __init__(self, content, code=200, headers=None):
+        if isinstance(content, unicode):
+            content = content.encode('utf8')
+        if not isinstance(content, str):
+            raise TypeError("StaticResponse content must be a string")
+
+        self._digest = hashlib.md5(content).digest()
+
+        headers = util.CaseInsensitiveOrderedMultiDict(headers or {})
+        if 'content-length' not in headers:
+            headers['Content-Length'] = str(len(content))
+        if self.default_content_type and 'content-type' not in headers:
+            headers['Content-Type'] = self.default_content_type
+        if 'etag' not in headers:
+            headers['ETag'] = '"%s"' % self._digest.encode('hex')
+
+        self.content = content
+        "the response string"
+
+        self.code = code
+        "integer HTTP status code (defaults to 200)"
+
+        self.reason = HTTP_CODE_DATA[code][0]
+        "the reason phrase for the status code"
+
+        self.status = "%d %s" % (code, self.reason)
+        "the complete status line"
+
+        self.headerlist = tuple(headers.iteritems())
+        "the response headers as (name, value) pairs"
+
+        self._headers = util.FrozenCaseInsensitiveMultiDict(self.headerlist)
+
+        self._head = None
+
+    def __call__(self, request, *args, **kwargs):
+        "acts as a handler which always returns this response"
+        return self
+
+    def head(self):
+        "this response without its body, for HEAD requests"
+        if self._head is None:
+            head = StaticResponse("", self.code, self.headerlist)
+            head._head = self._head = head
+        return self._head
+
+    def finalize(self, request):
+        "a StaticResponse is final from the start"
+        pass
+
+
+class FileResponse(Response):
+    """A response with its body streamed from a file
+
+    ``body`` is a path or a file object opened in binary mode, which is read
+    from its current position to the end, or for at most ``length`` bytes.
+    Content-Length is filled in if the size can be found out (it is a
+    regular file on disk).
+
+    On WSGI the file is handed to the server's ``wsgi.file_wrapper`` if it
+    has one and there is no ``length``, so it can be sent with sendfile(2).
+    Otherwise, and on
+    gevent.http, it is streamed in :attr:`BLOCKSIZE` chunks, so the whole
+    file is never held in memory. The file is closed once it has been sent.
+    """
+    default_content_type = "application/octet-stream"
+    "The content-type that will be assigned if none is provided"
+
+    BLOCKSIZE = 2**16
+    "size of the chunks the file is read and sent in"
+
+    def __init__(self, body, code=200, headers=None, length=None):
+        if isinstance(body, basestring):
+            body = open(body, 'rb')
+        self.file = body
+        "the file the response body is read from"
+
+        self.length = length
+        "the most bytes to send from the file, or None for all that's left"
+
+        super(FileResponse, self).__init__(self._iterblocks(), code, headers)
+
+        if not self.has_header('content-length'):
+            size = self._remaining_size()
+            if size is not None:
+                if length is not None:
+                    size = min(size, length)
+                self.add_header('Content-Length', str(size))
+
+    def _remaining_size(self):
+        try:
+            st = os.fstat(self.file.fileno())
+            if not stat.S_ISREG(st.st_mode):
+                return None
+            return st.st_size - self.file.tell()
+        except (AttributeError, EnvironmentError):
+            return None
+
+    def _iterblocks(self):
+        remaining = self.length
+        try:
+            while remaining is None or remaining > 0:
+                size = self.BLOCKSIZE
+                if remaining is not None:
+                    size = min(size, remaining)
+                    remaining -= size
+                block = self.file.read(size)
+                if not block:
+                    break
+                yield block
+        finally:
+            self.file.close()
+
+
+def _etag_matches(request, etag):
+    # weak comparison against the request's If-None-Match. Finder.wsgi
+    # splits header values on commas, so they're put back together first
+    tags = ",".join(request.headers.getall('if-none-match'))
+    if not tags:
+        return False
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    for tag in tags.split(','):
+        tag = tag.strip()
+        if tag == '*' or (tag[2:] if tag.startswith('W/') else tag) == etag:
+            return True
+    return False
+
+
+_NO_COOKIES = util.FrozenCaseInsensitiveMultiDict()
+
+_NOT_MODIFIED_HEADERS = frozenset(['cache-control', 'content-location',
+    'date', 'etag', 'expires', 'last-modified', 'set-cookie', 'vary'])
+
+def _not_modified(headerlist):
+    # a 304 carrying over the headers from ``headerlist`` that it should
+    names = util.lower_header_names
+    response = Response("", code=304, headers=[(key, value)
+            for key, value in headerlist
+            if (names[key] if key in names else key.lower())
+                in _NOT_MODIFIED_HEADERS])
+    response.default_content_type = None
+    return response
+
+
+def _not_modified_for(request, response):
+    # a 304 in place of the 200 ``response``, with the ETag and Vary it
+    # would be sent with after compression
+    headers = response.headerlist
+    if request.compression is not None:
+        headers = request.compression.headers(request, response)
+    return _not_modified(headers)
+
+
+def _headers_only(response):
+    # the response to a HEAD request, with Content-Length where it can be
+    # had without reading the body, which is closed
+    if isinstance(response, StaticResponse):
+        return response.head()
+
+    body = response.content
+    headers = response.headerlist
+    if not response.has_header('content-length'):
+        length = None
+        if isinstance(body, str):
+            length = len(body) or None
+        elif isinstance(body, (list, tuple)):
+            length = sum(len(chunk) for chunk in body)
+        if length is not None:
+            headers = headers + [('Content-Length', str(length))]
+
+    _close_body(response)
+    return Response("", response.code, headers)
+
+
+def _close_body(response):
+    # release what an unsent response body holds (an unstarted generator's
+    # close() doesn't run its finally clause, so FileResponse needs help)
+    if isinstance(response, FileResponse):
+        response.file.close()
+    elif hasattr(response.content, 'close'):
+        response.content.close()
+
+
+def _prepare_chunks(response, buffer_size):
+    # Content-Length for a list or tuple body, and buffering of the chunks
+    body = response.content
+    if isinstance(body, (list, tuple)) and \
+            not response.has_header('content-length'):
+        response.add_header('Content-Length',
+                str(sum(len(chunk) for chunk in body)))
+    if buffer_size:
+        response.content = _coalesced(body, buffer_size)
+
+
+def _coalesced(chunks, size):
+    # the strings of ``chunks`` joined into ones of at least ``size`` bytes
+    # (but the last), closing ``chunks`` afterwards as WSGI would
+    buffered, length = [], 0
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            buffered.append(chunk)
+            length += len(chunk)
+            if length >= size:
+                yield buffered[0] if len(buffered) == 1 else "".join(buffered)
+                buffered, length = [], 0
+        if buffered:
+            yield "".join(buffered)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
 
 
 def _parse_headers(keyvals):
-    headers = util.CaseInsensitiveOrderedMultiDict()
-    ctopts, cdopts = {}, {}
+    pairs = []
+    ctopts = cdopts = multipart.HeaderOptions()
     for key, val in keyvals:
-        lkey = key.lower()
+        if key in util.lower_header_names:
+            lkey = util.lower_header_names[key]
+        else:
+            lkey = key.lower()
         if lkey == 'content-type':
             val, ctopts = multipart.parse_options_header(val)
         elif lkey == 'content-disposition':
             val, cdopts = multipart.parse_options_header(val)
-        headers[key] = val
+        pairs.append((key, val))
+    headers = util.FrozenCaseInsensitiveMultiDict(pairs)
     return headers, ctopts, cdopts
 
 
@@ -449,9 +980,87 @@ def _parse_cookies(cookie_headers):
     return cookies
 
 
-multipartpart = collections.namedtuple('multipartpart',
+class multipartpart(collections.namedtuple('multipartpart',
         ('headers', 'size', 'name', 'filename', 'charset',
-            'content_type_opts', 'content_disposition_opts', 'body'))
+            'content_type_opts', 'content_disposition_opts', 'body'))):
+    __slots__ = ()
+
+    @property
+    def body(self):
+        "the part's data decoded with its charset (None if it went to a sink)"
+        return self[7].value
+
+    @property
+    def part(self):
+        "the underlying :class:`pathfinder.multipart.MultipartPart`"
+        return self[7].part
+
+    @property
+    def digests(self):
+        "hex digests of the body by algorithm, as requested in part_digests"
+        return self.part.digests
+
+    def getbuffer(self):
+        """a read-only buffer of the raw body
+
+        an mmap of the file for parts spooled to disk, which isn't copied
+        into memory. parts held in memory (up to ``memfile_limit`` bytes)
+        get a memoryview of a copy of their data.
+        """
+        return self.part.getbuffer()
+
+
+class _partbody(object):
+    # stands in for the decoded body in a multipartpart tuple (indexed,
+    # unpacked or via _asdict), so it is only decoded if it is used
+    __slots__ = ['part']
+
+    def __init__(self, part):
+        self.part = part
+
+    @property
+    def value(self):
+        if self.part.sink is not None:
+            return None
+        return self.part.value
+
+    def __unicode__(self):
+        return unicode(self.value)
+
+    def __str__(self):
+        return str(self.value)
+
+    def __repr__(self):
+        return repr(self.value)
+
+    def __eq__(self, other):
+        if isinstance(other, _partbody):
+            other = other.value
+        return self.value == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __getitem__(self, index):
+        return self.value[index]
+
+    def __add__(self, other):
+        return self.value + other
+
+    def __radd__(self, other):
+        return other + self.value
+
+    def __getattr__(self, name):
+        return getattr(self.value, name)
 
 
 NoResponse = object()
@@ -0,0 +1,268 @@
+"""pathfinder.cache -- caching of whole responses to GET requests
+
+Copyright 2011 Jawbone Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# vim: fileencoding=utf8:et:sta:ai:sw=4:ts=4:sts=4
+
+from __future__ import absolute_import
+
+import collections
+import hashlib
+import marshal
+import mmap
+import multiprocessing
+import struct
+import threading
+import time
+
+from . import StaticResponse
+
+
+__all__ = ["ResponseCache", "MemoryBackend", "SharedMemoryBackend"]
+
+_NO_STORE = ('no-store', 'no-cache', 'private')
+_PERSONAL = ('authorization', 'cookie')
+
+
+class ResponseCache(object):
+    """Caches the finalized responses to GET requests on a route
+
+    Put one in a route's options as ``cache``. Responses are kept for
+    ``ttl`` seconds, keyed by the request's path, query string and the
+    values of the request headers named in ``vary``, and a hit is sent
+    without calling the handler at all. Only 200 responses with a string
+    body are stored, and not those which set cookies, have a Cache-Control
+    of no-store, no-cache or private, or a Vary header naming anything
+    outside ``vary``. Requests with an Authorization or Cookie header are
+    passed through unless it's in ``vary``, as their responses may be
+    particular to the user.
+
+    ``backend`` is where the responses are kept, by default a
+    :class:`MemoryBackend` of up to ``max_entries`` responses and
+    ``max_bytes`` bytes of bodies.
+    """
+    def __init__(self, ttl=5, vary=(), backend=None, max_entries=1024,
+            max_bytes=2**26):
+        self.ttl = ttl
+        self.vary = tuple(name.lower() for name in vary)
+        if backend is None:
+            backend = MemoryBackend(max_entries, max_bytes)
+        self.backend = backend
+
+    def key(self, request):
+        """the cache key for a request, or None if it can't be cached"""
+        for name in _PERSONAL:
+            if name in request.headers and name not in self.vary:
+                return None
+        parts = [request.path, request.query_string]
+        for name in self.vary:
+            parts.append(",".join(request.headers.getall(name)))
+        return "\0".join(parts)
+
+    def get(self, key):
+        "the cached :class:`pathfinder.StaticResponse` for a key, or None"
+        return self.backend.get(key)
+
+    def store(self, key, path, response):
+        """cache a finalized response if it is suitable
+
+        returns the :class:`pathfinder.StaticResponse` that was stored, or
+        ``response`` unchanged if it wasn't
+        """
+        if response.code != 200 or not isinstance(response.content, str) or \
+                response.has_header('set-cookie'):
+            return response
+        control = response.get_header('cache-control', '').lower()
+        for directive in _NO_STORE:
+            if directive in control:
+                return response
+        vary = response.get_header('vary')
+        if vary is not None:
+            for name in vary.split(','):
+                name = name.strip().lower()
+                if name == '*' or name not in self.vary:
+                    return response
+
+        if not isinstance(response, StaticResponse):
+            response = StaticResponse(
+                    response.content, response.code, response.headerlist)
+        self.backend.set(key, path, response, self.ttl)
+        return response
+
+    def invalidate(self, path):
+        "drop all the cached responses for a path (whatever the query)"
+        self.backend.delete_group(path)
+
+    def clear(self):
+        "drop all the cached responses"
+        self.backend.clear()
+
+
+class MemoryBackend(object):
+    """A :class:`ResponseCache` backend in this process' memory
+
+    it holds up to ``max_entries`` responses and ``max_bytes`` bytes of
+    their bodies, evicting the least recently used.
+    """
+    def __init__(self, max_entries=1024, max_bytes=2**26):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._groups = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            if entry[3] < time.time():
+                self._forget(key, entry)
+                return None
+            self._entries[key] = entry
+            return entry[0]
+
+    def set(self, key, group, response, ttl):
+        size = len(response.content)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._forget(key, old)
+            self._entries[key] = (response, group, size, time.time() + ttl)
+            self._groups.setdefault(group, set()).add(key)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or \
+                    self._bytes > self.max_bytes:
+                self._forget(*self._entries.popitem(last=False))
+
+    def delete_group(self, group):
+        with self._lock:
+            for key in list(self._groups.get(group, ())):
+                self._forget(key, self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+            self._bytes = 0
+
+    def _forget(self, key, entry):
+        # account for an entry already removed from self._entries
+        group = entry[1]
+        keys = self._groups[group]
+        keys.discard(key)
+        if not keys:
+            del self._groups[group]
+        self._bytes -= entry[2]
+
+
+class SharedMemoryBackend(object):
+    """A :class:`ResponseCache` backend shared between forked processes
+
+    create it (and the caches using it) in the parent before forking the
+    workers of a prefork server, and they all share its contents.
+
+    it is a table in an anonymous shared memory map of ``slots`` slots of
+    ``slot_size`` bytes, grouped ``ways`` to a set. a key can only go in one
+    set, where it displaces the least recently used entry, and responses
+    which don't fit in a slot aren't stored.
+    """
+    _header = struct.Struct('<16s16sddI')
+    _empty = '\0' * 16
+
+    def __init__(self, slots=4096, slot_size=2**14, ways=4):
+        if slot_size <= self._header.size:
+            raise ValueError("slot_size is too small")
+        self.slot_size = slot_size
+        self.ways = ways
+        self._sets = max(slots // ways, 1)
+        self._map = mmap.mmap(-1, self._sets * ways * slot_size)
+        self._lock = multiprocessing.Lock()
+
+    def get(self, key):
+        digest = hashlib.md5(key).digest()
+        now = time.time()
+        header = self._header
+        with self._lock:
+            offset = self._find(digest)
+            if offset is None:
+                return None
+            found, group, expires, used, length = header.unpack_from(
+                    self._map, offset)
+            if expires < now:
+                header.pack_into(self._map, offset,
+                        self._empty, group, expires, used, length)
+                return None
+            header.pack_into(self._map, offset,
+                    digest, group, expires, now, length)
+            start = offset + header.size
+            data = self._map[start:start + length]
+
+        code, headerlist, content = marshal.loads(data)
+        return StaticResponse(content, code, headerlist)
+
+    def set(self, key, group, response, ttl):
+        data = marshal.dumps(
+                (response.code, response.headerlist, response.content))
+        if len(data) > self.slot_size - self._header.size:
+            return
+        digest = hashlib.md5(key).digest()
+        now = time.time()
+        header = self._header
+        with self._lock:
+            offset = self._find(digest)
+            if offset is None:
+                # take the empty or least recently used slot in the set
+                oldest = None
+                for slot in self._set_slots(digest):
+                    used = header.unpack_from(self._map, slot)[3]
+                    if oldest is None or used < oldest:
+                        oldest, offset = used, slot
+            header.pack_into(self._map, offset, digest,
+                    hashlib.md5(group).digest(), now + ttl, now, len(data))
+            start = offset + header.size
+            self._map[start:start + len(data)] = data
+
+    def delete_group(self, group):
+        digest = hashlib.md5(group).digest()
+        header = self._header
+        with self._lock:
+            for offset in xrange(0, len(self._map), self.slot_size):
+                fields = header.unpack_from(self._map, offset)
+                if fields[1] == digest:
+                    header.pack_into(self._map, offset,
+                            self._empty, self._empty, 0, 0, 0)
+
+    def clear(self):
+        header = self._header
+        with self._lock:
+            for offset in xrange(0, len(self._map), self.slot_size):
+                header.pack_into(self._map, offset,
+                        self._empty, self._empty, 0, 0, 0)
+
+    def _set_slots(self, digest):
+        index = struct.unpack_from('<Q', digest)[0] % self._sets
+        base = index * self.ways * self.slot_size
+        return xrange(base, base + self.ways * self.slot_size,
+                self.slot_size)
+
+    def _find(self, digest):
+        for offset in self._set_slots(digest):
+            if self._map[offset:offset + 16] == digest:
+                return offset
+        return None
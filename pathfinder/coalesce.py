@@ -0,0 +1,101 @@
+"""pathfinder.coalesce -- sharing one handler call between identical requests
+
+Copyright 2011 Jawbone Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# vim: fileencoding=utf8:et:sta:ai:sw=4:ts=4:sts=4
+
+from __future__ import absolute_import
+
+import threading
+
+from . import StaticResponse
+
+
+__all__ = ["Coalescer"]
+
+_PERSONAL = ('authorization', 'cookie')
+
+
+class Coalescer(object):
+    """Lets concurrent identical GET requests share a single handler call
+
+    Put one in a route's options as ``coalesce``. While the handler is
+    running for a request, others with the same path, query string and
+    values of the request headers named in ``key_headers`` wait for it
+    instead of calling the handler themselves, and all get its response.
+    Requests with an Authorization or Cookie header aren't coalesced unless
+    it's in ``key_headers``, as their responses may be particular to the
+    user.
+
+    Only responses which can be frozen into a
+    :class:`pathfinder.StaticResponse` are shared: 200s with a string body
+    that don't set cookies. For any others, and if the wait exceeds
+    ``timeout`` seconds, the waiting requests go on to call the handler.
+
+    ``event`` makes the objects the requests wait on, by default
+    ``threading.Event`` which suits threads and monkey-patched gevent. pass
+    ``gevent.event.Event`` for greenlets without monkey-patching.
+    """
+    def __init__(self, key_headers=(), timeout=None, event=None):
+        self.key_headers = tuple(name.lower() for name in key_headers)
+        self.timeout = timeout
+        self.event = event or threading.Event
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def key(self, request):
+        """the key identifying requests which can share a response, or None
+        if the request shouldn't share one"""
+        for name in _PERSONAL:
+            if name in request.headers and name not in self.key_headers:
+                return None
+        parts = [request.method, request.path, request.query_string]
+        for name in self.key_headers:
+            parts.append(",".join(request.headers.getall(name)))
+        return "\0".join(parts)
+
+    def call(self, key, func):
+        """call ``func``, unless a call for the same key is in progress
+
+        in which case wait for that one and produce its result if it can
+        be shared, calling ``func`` after all if not
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leading = flight is None
+            if leading:
+                flight = self._flights[key] = _flight(self.event())
+
+        if not leading:
+            flight.event.wait(self.timeout)
+            if isinstance(flight.result, StaticResponse):
+                return flight.result
+            return func()
+
+        try:
+            flight.result = func()
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+        return flight.result
+
+
+class _flight(object):
+    __slots__ = ['event', 'result']
+
+    def __init__(self, event):
+        self.event = event
+        self.result = None
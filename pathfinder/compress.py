@@ -0,0 +1,267 @@
+"""pathfinder.compress -- gzip/deflate content-coding of response bodies
+
+Copyright 2011 Jawbone Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# vim: fileencoding=utf8:et:sta:ai:sw=4:ts=4:sts=4
+
+from __future__ import absolute_import
+
+import collections
+import hashlib
+import threading
+import zlib
+
+from . import Response, StaticResponse, util, _close_body
+
+
+__all__ = ["Compressor"]
+
+_WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+class Compressor(object):
+    """Compresses response bodies for the clients which accept it
+
+    Pass one as ``compression`` to a :class:`pathfinder.Finder` or in a
+    route's options. It compresses 200 responses to requests whose
+    Accept-Encoding allows one of ``encodings`` (in order of preference),
+    if their Content-Type is text or one of ``types`` and they don't already
+    have a Content-Encoding. String bodies shorter than ``min_size`` are
+    left alone, and iterable bodies are compressed incrementally as they are
+    sent (or for HEAD requests, closed unread leaving the headers without a
+    Content-Length). Vary: Accept-Encoding is added to all the responses it
+    considers.
+
+    Compressed bodies are kept in an LRU cache of up to ``max_entries``
+    entries and ``max_bytes`` bytes, identified by a digest of the original
+    body. Those of :class:`pathfinder.StaticResponse`\ s are kept, as
+    StaticResponses themselves, and string bodies of other responses with a
+    strong ETag (which gets weakened in the compressed response, as the
+    bytes differ). Responses with a Cache-Control of private or no-store, or
+    which set cookies, aren't kept.
+    """
+    TYPES = frozenset([
+        'application/javascript', 'application/json', 'application/xml',
+        'application/xhtml+xml', 'application/x-javascript',
+        'image/svg+xml'])
+    "the compressible content types besides text/*"
+
+    def __init__(self, encodings=('gzip', 'deflate'), level=6, min_size=256,
+            types=None, max_entries=256, max_bytes=2**24):
+        for encoding in encodings:
+            if encoding not in _WBITS:
+                raise ValueError("unsupported encoding: %r" % encoding)
+        self.encodings = tuple(encodings)
+        self.level = level
+        self.min_size = min_size
+        self.types = self.TYPES if types is None else frozenset(types)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._cache = collections.OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+        self._accepts = {}
+
+    def compress(self, request, response):
+        """produce the response to send in place of ``response``
+
+        this is applied to finalized responses. it may return ``response``
+        itself (with a Vary header added), or a new response with the
+        compressed body (a :class:`pathfinder.StaticResponse` in place of
+        one).
+        """
+        if not self._considers(response):
+            return response
+
+        encoding = self._encoding(request)
+        static = isinstance(response, StaticResponse)
+        key = None
+        if _keepable(response):
+            if static:
+                # the variant is a whole response, so its headers count too
+                key = (response._digest, response.headerlist, encoding)
+            elif isinstance(response.content, str):
+                etag = response.get_header('etag')
+                if etag and not etag.startswith('W/'):
+                    key = (hashlib.md5(response.content).digest(), encoding)
+
+        if key is not None:
+            variant = self._get(key)
+            if variant is not None:
+                if static:
+                    return variant
+                return Response(variant, response.code, _headers(
+                        response.headerlist, encoding, len(variant)))
+
+        body = response.content
+        if encoding is None or (isinstance(body, str) and
+                len(body) < self.min_size):
+            if static:
+                variant = StaticResponse(body, response.code,
+                        _headers(response.headerlist, None, len(body)))
+                self._put(key, variant, 0)
+                return variant
+            response.add_header('Vary', 'Accept-Encoding')
+            return response
+
+        if isinstance(body, str):
+            compressor = zlib.compressobj(
+                    self.level, zlib.DEFLATED, _WBITS[encoding])
+            body = compressor.compress(body) + compressor.flush()
+            if static:
+                variant = StaticResponse(body, response.code,
+                        _headers(response.headerlist, encoding, len(body)))
+                self._put(key, variant, len(body))
+                return variant
+            if key is not None:
+                self._put(key, body, len(body))
+            length = len(body)
+        elif request.method == 'HEAD':
+            # the compressed length isn't known without reading it all, so
+            # only the headers are sent
+            _close_body(response)
+            body, length = "", None
+        else:
+            body = self._iterchunks(body, encoding)
+            length = None
+
+        return Response(body, response.code,
+                _headers(response.headerlist, encoding, length))
+
+    def headers(self, request, response):
+        """the headers :meth:`compress` would send ``response`` with
+
+        without compressing the body (and leaving out Content-Length), for a
+        304 to carry the same ETag and Vary as the 200 it stands for
+        """
+        if not self._considers(response):
+            return response.headerlist
+        encoding = self._encoding(request)
+        if isinstance(response.content, str) and \
+                len(response.content) < self.min_size:
+            encoding = None
+        return _headers(response.headerlist, encoding, None)
+
+    def clear(self):
+        "empty the cache of compressed bodies"
+        with self._lock:
+            self._cache.clear()
+            self._cached_bytes = 0
+
+    def _considers(self, response):
+        # whether the response is one to compress for clients that accept it
+        if response.code != 200 or response.has_header('content-encoding'):
+            return False
+        ctype = response.get_header('content-type', '')
+        ctype = ctype.split(';', 1)[0].strip().lower()
+        return ctype.startswith('text/') or ctype in self.types or \
+                ctype.endswith('+json') or ctype.endswith('+xml')
+
+    def _encoding(self, request):
+        # the preferred encoding that the request accepts, or None
+        header = ",".join(request.headers.getall('accept-encoding'))
+        if header in self._accepts:
+            return self._accepts[header]
+
+        qualities = {}
+        for item in header.split(','):
+            parts = item.split(';')
+            coding = parts[0].strip().lower()
+            q = 1.0
+            for param in parts[1:]:
+                name, _, value = param.partition('=')
+                if name.strip().lower() == 'q':
+                    try:
+                        q = float(value)
+                    except ValueError:
+                        q = 0.0
+            if coding:
+                qualities[coding] = q
+
+        result = None
+        for encoding in self.encodings:
+            if qualities.get(encoding, qualities.get('*', 0.0)) > 0:
+                result = encoding
+                break
+
+        if len(self._accepts) >= 256:
+            self._accepts.clear()
+        self._accepts[header] = result
+        return result
+
+    def _iterchunks(self, chunks, encoding):
+        # closes ``chunks`` afterwards, as the WSGI server would have
+        compressor = zlib.compressobj(
+                self.level, zlib.DEFLATED, _WBITS[encoding])
+        try:
+            for chunk in chunks:
+                chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+            yield compressor.flush()
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._cache.pop(key, None)
+            if entry is None:
+                return None
+            self._cache[key] = entry
+            return entry[0]
+
+    def _put(self, key, value, size):
+        if key is None or size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._cached_bytes -= old[1]
+            self._cache[key] = (value, size)
+            self._cached_bytes += size
+            while len(self._cache) > self.max_entries or \
+                    self._cached_bytes > self.max_bytes:
+                self._cached_bytes -= self._cache.popitem(last=False)[1][1]
+
+
+def _keepable(response):
+    # whether the compressed body of a response may be cached for reuse
+    if response.has_header('set-cookie') or response.cookies:
+        return False
+    control = response.get_header('cache-control', '').lower()
+    return 'private' not in control and 'no-store' not in control
+
+
+def _headers(headerlist, encoding, length):
+    # a response's headers adjusted for its body with ``encoding`` applied
+    names = util.lower_header_names
+    headers = []
+    for key, value in headerlist:
+        lower = names[key] if key in names else key.lower()
+        if lower == 'content-length':
+            continue
+        if encoding and lower == 'etag' and not value.startswith('W/'):
+            value = 'W/' + value
+        headers.append((key, value))
+    if encoding:
+        headers.append(('Content-Encoding', encoding))
+    headers.append(('Vary', 'Accept-Encoding'))
+    if length is not None:
+        headers.append(('Content-Length', str(length)))
+    return headers
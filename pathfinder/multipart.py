@@ -37,9 +37,9 @@ __author__ = 'Marcel Hellkamp'
 __version__ = '0.1'
 __license__ = 'MIT'
 
-from tempfile import TemporaryFile
+from tempfile import NamedTemporaryFile
 from wsgiref.headers import Headers
-import re, sys
+import hashlib, mmap, os, re, sys, threading, time
 try:
     from urlparse import parse_qs
 except ImportError: # pragma: no cover (fallback for Python 2.5)
@@ -91,7 +91,7 @@ class MultiDict(DictMixin):
 def tob(data, enc='utf8'): # Convert strings to bytes (py2 and py3)
     return data.encode(enc) if isinstance(data, unicode) else data
 
-def copy_file(stream, target, maxread=-1, buffer_size=2*16):
+def copy_file(stream, target, maxread=-1, buffer_size=2**16):
     ''' Read from :stream and write to :target until :maxread or EOF. '''
     size, read = 0, stream.read
     while 1:
@@ -101,6 +101,28 @@ def copy_file(stream, target, maxread=-1, buffer_size=2*16):
         target.write(part)
         size += len(part)
 
+_sendfile = getattr(os, 'sendfile', None) # Python 3.3+
+_fallocate = getattr(os, 'posix_fallocate', None) # Python 3.3+
+
+def send_file(stream, target, size, buffer_size=2**16):
+    ''' Copy :size bytes from the start of the real file :stream to :target,
+        inside the kernel with os.sendfile where that is available. '''
+    stream.flush()
+    target.flush()
+    offset = 0
+    if _sendfile is not None:
+        try:
+            while offset < size:
+                sent = _sendfile(target.fileno(), stream.fileno(), offset,
+                                 size - offset)
+                if not sent: break
+                offset += sent
+            return offset
+        except OSError: # e.g. no sendfile(2) to regular files on this kernel
+            if offset: raise
+    stream.seek(0)
+    return copy_file(stream, target, size, buffer_size)
+
 ##############################################################################
 ################################ Header Parser ################################
 ##############################################################################
@@ -125,16 +147,56 @@ def header_unquote(val, filename=False):
         return val.replace('\\\\','\\').replace('\\"','"')
     return val
 
+class HeaderOptions(dict):
+    ''' Options parsed from a header. Immutable, as they are shared between
+        all callers through the parse_options_header cache. '''
+    def _immutable(self, *a, **k):
+        raise TypeError('HeaderOptions are immutable')
+    __setitem__ = __delitem__ = clear = pop = popitem = _immutable
+    setdefault = update = _immutable
+
+    def __reduce__(self):
+        # copies and unpickled copies are plain (mutable) dicts
+        return (dict, (dict(self),))
+
+_no_options = HeaderOptions()
+_options_cache = {}
+_options_cache_size = 1024
+_options_cache_max_len = 256
+
 def parse_options_header(header, options=None):
+    ''' Split a Content-Type like header into its lowercased value and a
+        dict of options. Results are cached (unless :options is given, which
+        the options are merged into) and their options are immutable.
+        Values which are long or carry a filename or boundary are mostly
+        unique, so they aren't cached. '''
+    if options is None:
+        try:
+            return _options_cache[header]
+        except KeyError:
+            pass
     if ';' not in header:
-        return header.lower().strip(), {}
-    ctype, tail = header.split(';', 1)
-    options = options or {}
-    for match in _re_option.finditer(tail):
-        key = match.group(1).lower()
-        value = header_unquote(match.group(2), key=='filename')
-        options[key] = value
-    return ctype, options
+        result = header.lower().strip(), \
+                _no_options if options is None else options
+    else:
+        ctype, tail = header.split(';', 1)
+        opts = {} if options is None else options
+        for match in _re_option.finditer(tail):
+            key = match.group(1).lower()
+            value = header_unquote(match.group(2), key=='filename')
+            opts[key] = value
+        if options is None:
+            opts = HeaderOptions(opts)
+        result = ctype.lower().strip(), opts
+    if options is None and len(header) <= _options_cache_max_len:
+        lowered = header.lower()
+        if 'filename=' in lowered or 'boundary=' in lowered:
+            return result
+        # rather than track recency just start over when the cache is full
+        if len(_options_cache) >= _options_cache_size:
+            _options_cache.clear()
+        _options_cache[header] = result
+    return result
 
 ##############################################################################
 ################################## Multipart ##################################
@@ -144,17 +206,68 @@ def parse_options_header(header, options=None):
 class MultipartError(ValueError): pass
 
 
+class MultipartLimitError(MultipartError): pass
+
+
+class MemoryBudget(object):
+
+    def __init__(self, limit, timeout=0):
+        ''' A number of bytes shared by all the parsers it is passed to, which
+            caps the memory held by every in-flight parse in the process.
+
+            :param limit: The total number of bytes available.
+            :param timeout: How long a parser may wait for memory to be
+                            released before giving up (default: don't wait).
+        '''
+        self.limit, self.timeout = limit, timeout
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, size):
+        self._cond.acquire()
+        try:
+            if self.used + size > self.limit and size <= self.limit:
+                deadline = time.time() + self.timeout
+                while self.used + size > self.limit:
+                    remaining = deadline - time.time()
+                    if remaining <= 0: break
+                    self._cond.wait(remaining)
+            if self.used + size > self.limit:
+                raise MultipartLimitError("Memory budget exhausted.")
+            self.used += size
+        finally:
+            self._cond.release()
+
+    def release(self, size):
+        self._cond.acquire()
+        try:
+            self.used -= size
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+
+
 class MultipartParser(object):
     
     def __init__(self, stream, boundary, content_length=-1,
                  disk_limit=2**30, mem_limit=2**20, memfile_limit=2**18,
-                 buffer_size=2**16, charset='latin1'):
+                 buffer_size=2**16, charset='latin1', sinks=None,
+                 tmpdir=None, budget=None, digests=()):
         ''' Parse a multipart/form-data byte stream. This object is an iterator
             over the parts of the message.
             
             :param stream: A file-like stream. Must implement ``.read(size)``.
             :param boundary: The multipart boundary as a byte string.
             :param content_length: The maximum number of bytes to read.
+            :param sinks: A dict mapping field names to callables. The body of
+                          a part with that name is passed to the callable
+                          chunk by chunk instead of being buffered.
+            :param tmpdir: The directory to spool large parts to (defaults to
+                           the system temp directory).
+            :param budget: A :class:`MemoryBudget` to charge buffered parts
+                           against while parsing.
+            :param digests: Names of hashlib algorithms to compute over the
+                            body of each part as it is parsed.
         '''
         self.stream, self.boundary = stream, boundary
         self.content_length = content_length
@@ -163,6 +276,10 @@ class MultipartParser(object):
         self.mem_limit = min(mem_limit, self.disk_limit)
         self.buffer_size = min(buffer_size, self.mem_limit)
         self.charset = charset
+        self.sinks = {} if sinks is None else sinks
+        self.tmpdir = tmpdir
+        self.budget = budget
+        self.digests = digests
         if self.buffer_size - 6 < len(boundary): # "--boundary--\r\n"
             raise MultipartError('Boundary does not fit into buffer_size.')
         self._done = []
@@ -193,101 +310,224 @@ class MultipartParser(object):
         ''' Return a list of parts with that name. '''
         return [p for p in self if p.name == name]
 
-    def _lineiter(self):
-        ''' Iterate over a binary file-like object line by line. Each line is
-            returned as a (line, line_ending) tuple. If the line does not fit
-            into self.buffer_size, line_ending is empty and the rest of the line
-            is returned with the next iteration.
-        '''
+    def _iterparse(self):
         read = self.stream.read
         maxread, maxbuf = self.content_length, self.buffer_size
-        _bcrnl = tob('\r\n')
-        _bcr = _bcrnl[:1]
-        _bnl = _bcrnl[1:]
-        _bempty = _bcrnl[:0] # b'rn'[:0] -> b''
-        buffer = _bempty # buffer for the last (partial) line
-        while 1:
-            data = read(maxbuf if maxread < 0 else min(maxbuf, maxread))
-            maxread -= len(data)
-            lines = (buffer+data).splitlines(True)
-            len_first_line = len(lines[0])
-            # be sure that the first line does not become too big
-            if len_first_line > self.buffer_size:
-                # at the same time don't split a '\r\n' accidentally
-                if (len_first_line == self.buffer_size+1 and
-                    lines[0].endswith(_bcrnl)):
-                    splitpos = self.buffer_size - 1
-                else:
-                    splitpos = self.buffer_size
-                lines[:1] = [lines[0][:splitpos],
-                             lines[0][splitpos:]]
-            if data:
-                buffer = lines[-1]
-                lines = lines[:-1]
-            for line in lines:
-                if line.endswith(_bcrnl): yield line[:-2], _bcrnl
-                elif line.endswith(_bnl): yield line[:-1], _bnl
-                elif line.endswith(_bcr): yield line[:-1], _bcr
-                else:                     yield line, _bempty
-            if not data:
-                break
-    
-    def _iterparse(self):
-        lines, line = self._lineiter(), ''
-        separator = tob('--') + tob(self.boundary)
-        terminator = tob('--') + tob(self.boundary) + tob('--')
-        # Consume first boundary. Ignore leading blank lines
-        for line, nl in lines:
-            if line: break
-        if line != separator:
-            raise MultipartError("Stream does not start with boundary")
-        # For each part in stream...
+        parser = MultipartPushParser(self.boundary,
+                buffer_size=self.buffer_size,
+                memfile_limit=self.memfile_limit,
+                charset=self.charset,
+                tmpdir=self.tmpdir,
+                digests=self.digests,
+                content_length=self.content_length)
         mem_used, disk_used = 0, 0 # Track used resources to prevent DoS
-        is_tail = False # True if the last line was incomplete (cutted)
-        opts = {'buffer_size': self.buffer_size,
-                'memfile_limit': self.memfile_limit,
-                'charset': self.charset}
-        part = MultipartPart(**opts)
-        for line, nl in lines:
-            if line == terminator and not is_tail:
-                part.file.seek(0)
-                yield part
-                break
-            elif line == separator and not is_tail:
-                if part.is_buffered(): mem_used  += part.size
-                else:                  disk_used += part.size
-                part.file.seek(0)
-                yield part
-                part = MultipartPart(**opts)
-            else:
-                is_tail = not nl # The next line continues this one
-                part.feed(line, nl)
-                if part.is_buffered():
-                    if part.size + mem_used > self.mem_limit:
-                        raise MultipartError("Memory limit reached.")
-                elif part.size + disk_used > self.disk_limit:
-                    raise MultipartError("Disk limit reached.")
-        if line != terminator:
+        budget, held = self.budget, 0 # Bytes charged to the shared budget
+        try:
+            while not parser.done:
+                data = tob('')
+                if maxread:
+                    data = read(
+                            maxbuf if maxread < 0 else min(maxbuf, maxread))
+                if not data:
+                    parser.close()
+                if maxread > 0:
+                    maxread -= len(data)
+                for event, part, span in parser.feed(data):
+                    if event is PART_DATA:
+                        if part.sink is not None:
+                            part.write_body(span)
+                            continue # nothing is kept, so no limits apply
+                        if budget is not None and part.is_buffered():
+                            if part.size + len(span) <= self.memfile_limit:
+                                budget.acquire(len(span))
+                                held += len(span)
+                            else: # this span moves the part to disk
+                                budget.release(part.size)
+                                held -= part.size
+                        part.write_body(span)
+                        if part.is_buffered():
+                            if part.size + mem_used > self.mem_limit:
+                                raise MultipartLimitError(
+                                        "Memory limit reached.")
+                        elif part.size + disk_used > self.disk_limit:
+                            raise MultipartLimitError("Disk limit reached.")
+                    elif event is PART_START:
+                        part.sink = self.sinks.get(part.name)
+                        if part.sink is None and \
+                                part.expected_size > self.memfile_limit:
+                            part.spool() # skip the memory stage altogether
+                    elif event is PART_END:
+                        if part.sink is not None: pass
+                        elif part.is_buffered(): mem_used  += part.size
+                        else:                    disk_used += part.size
+                        part.finish_body()
+                        yield part
+        finally:
+            if held:
+                budget.release(held)
+
+
+PART_START, PART_DATA, PART_END = 'part-start', 'part-data', 'part-end'
+
+
+class MultipartPushParser(object):
+
+    def __init__(self, boundary, buffer_size=2**16, memfile_limit=2**18,
+                 charset='latin1', tmpdir=None, digests=(),
+                 content_length=-1):
+        ''' Incremental multipart/form-data parser. Instead of pulling from a
+            stream, it is handed chunks of the message as they arrive and
+            returns a list of ``(event, part, data)`` tuples for each:
+
+            - ``(PART_START, part, None)`` once a part's headers are parsed
+            - ``(PART_DATA, part, data)`` for each span of a part's body
+            - ``(PART_END, part, None)`` when the part's body is complete
+
+            Body data is not stored by this parser, pass it on to
+            ``part.write_body`` to have the part buffer it.
+
+            :param boundary: The multipart boundary as a byte string.
+            :param buffer_size: The maximum length of a header line.
+            :param content_length: The length of the message if known, which
+                                   bounds the expected size of each part.
+        '''
+        self.boundary = boundary
+        self.buffer_size = buffer_size
+        self.done = False
+        self._part_opts = {'buffer_size': buffer_size,
+                           'memfile_limit': memfile_limit,
+                           'charset': charset,
+                           'tmpdir': tmpdir,
+                           'digests': digests,
+                           'size_hint': content_length}
+        # Line endings may be CRLF or bare LF. The delimiter is searched for
+        # from the LF, and a CR before it is dropped from the body.
+        self._delimiter = tob('\n--') + tob(boundary)
+        # A virtual newline in front of the stream lets the first boundary
+        # be found by the same search as all the others.
+        self._buf = tob('\n')
+        self._pos = 0 # parsing resumes here, everything before is consumed
+        self._part = None
+        self._state = self._preamble
+
+    def feed(self, data):
+        ''' Parse the next chunk of the message and return its events. '''
+        if self.done: return [] # ignore the epilogue
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+        events = []
+        while self._state(events): pass
+        return events
+
+    def close(self):
+        ''' Signal the end of the message, raising if it was incomplete. '''
+        if self._state == self._preamble:
+            raise MultipartError("Stream does not start with boundary")
+        if not self.done:
             raise MultipartError("Unexpected end of multipart stream.")
-            
+
+    # Each state consumes what it can from the buffer by advancing _pos (so
+    # the buffer is sliced only once per feed), and returns True to continue
+    # with the next state or False if it needs more data.
+
+    def _preamble(self, events):
+        ''' Consume first boundary. Ignore leading blank lines '''
+        buf, dlen = self._buf, len(self._delimiter)
+        pos = buf.find(self._delimiter)
+        if pos >= 0:
+            if buf[:pos].strip():
+                raise MultipartError("Stream does not start with boundary")
+            self._pos = pos + dlen
+            self._state = self._delimited
+            return True
+        # the tail might be the start of a delimiter split across chunks
+        if buf[:1 - dlen].strip():
+            raise MultipartError("Stream does not start with boundary")
+        self._pos = max(len(buf) - dlen + 1, 0)
+        return False
+
+    def _delimited(self, events):
+        ''' '--' right after a delimiter closes the stream '''
+        start = self._pos
+        if len(self._buf) - start < 2:
+            return False
+        if self._buf[start:start + 2] == tob('--'):
+            self._buf, self._pos, self.done = tob(''), 0, True
+            return False
+        self._part = MultipartPart(**self._part_opts)
+        # The first line is the rest of the delimiter line, which may only
+        # hold whitespace. Header lines follow until a blank line.
+        self._padding = True
+        self._state = self._header
+        return True
+
+    def _header(self, events):
+        buf, part = self._buf, self._part
+        _bcr, _bnl = tob('\r'), tob('\n')
+        while part.headers is None:
+            start = self._pos
+            pos = buf.find(_bnl, start)
+            if pos < 0:
+                if len(buf) - start > self.buffer_size:
+                    raise MultipartError("Header line too long.")
+                return False
+            line, self._pos = buf[start:pos], pos + 1
+            if line.endswith(_bcr): line, nl = line[:-1], _bcr + _bnl
+            else:                   nl = _bnl
+            if self._padding:
+                if line.strip():
+                    raise MultipartError("Unexpected data after boundary.")
+                self._padding = False
+            else:
+                part.write_header(line, nl)
+        events.append((PART_START, part, None))
+        self._state = self._body
+        return True
+
+    def _body(self, events):
+        ''' The body is everything up to the next delimiter '''
+        buf, delimiter, start = self._buf, self._delimiter, self._pos
+        _bcr = tob('\r')
+        pos = buf.find(delimiter, start)
+        if pos >= 0:
+            self._pos = pos + len(delimiter)
+            if pos > start and buf[pos - 1:pos] == _bcr: pos -= 1
+            span = buf[start:pos]
+        else:
+            # hold back a tail that could begin a split delimiter, and a CR
+            # that could end up in front of one
+            cut = buf.find(delimiter[:1],
+                           max(len(buf) - len(delimiter) + 1, start))
+            if cut < 0: cut = len(buf)
+            if cut > start and buf[cut - 1:cut] == _bcr: cut -= 1
+            span, self._pos = buf[start:cut], cut
+        if span:
+            events.append((PART_DATA, self._part, span))
+        if pos < 0:
+            return False
+        events.append((PART_END, self._part, None))
+        self._part = None
+        self._state = self._delimited
+        return True
+
 
 class MultipartPart(object):
     
-    def __init__(self, buffer_size=2**16, memfile_limit=2**18, charset='latin1'):
+    def __init__(self, buffer_size=2**16, memfile_limit=2**18, charset='latin1',
+                 tmpdir=None, digests=(), size_hint=-1):
         self.headerlist = []
         self.headers = None
         self.file = False
         self.size = 0
-        self._buf = tob('')
         self.disposition, self.name, self.filename = None, None, None
         self.content_type, self.charset = None, charset
         self.memfile_limit = memfile_limit
         self.buffer_size = buffer_size
-
-    def feed(self, line, nl=''):
-        if self.file:
-            return self.write_body(line, nl)
-        return self.write_header(line, nl)
+        self.tmpdir = tmpdir
+        self.size_hint = size_hint # upper bound from the whole message
+        self.expected_size = -1
+        self.sink = None
+        self._hashes = [(name, hashlib.new(name)) for name in digests]
 
     def write_header(self, line, nl):
         line = line.decode(self.charset or 'latin1')
@@ -303,18 +543,42 @@ class MultipartPart(object):
             name, value = line.split(':', 1)
             self.headerlist.append((name.strip(), value.strip()))
 
-    def write_body(self, line, nl):
-        if not line and not nl: return # This does not even flush the buffer
-        self.size += len(line) + len(self._buf)
-        self.file.write(self._buf + line)
-        self._buf = nl
+    def write_body(self, data):
+        if not data: return
+        self.size += len(data)
+        for name, hash in self._hashes:
+            hash.update(data)
+        if self.sink is not None:
+            self.sink(data)
+        else:
+            self.file.write(data)
         if self.content_length > 0 and self.size > self.content_length:
             raise MultipartError('Size of body exceeds Content-Length header.')
+        if self.sink is not None:
+            return
         if self.size > self.memfile_limit and isinstance(self.file, BytesIO):
             # TODO: What about non-file uploads that exceed the memfile_limit?
-            self.file, old = TemporaryFile(mode='w+b'), self.file
-            old.seek(0)
-            copy_file(old, self.file, self.size, self.buffer_size)
+            self.spool()
+
+    def spool(self):
+        ''' Move the data to a temporary file, preallocating the part's
+            Content-Length where the platform supports it. '''
+        # Named, so that save_as(link=True) can hard-link it into place.
+        # The name is removed again as soon as the file is closed.
+        self.file, old = NamedTemporaryFile(mode='w+b',
+                dir=self.tmpdir, prefix='multipart-'), self.file
+        if _fallocate is not None and self.content_length > self.size:
+            try:
+                _fallocate(self.file.fileno(), 0, self.content_length)
+            except OSError: # unsupported by the filesystem
+                pass
+        self.file.write(old.getvalue())
+
+    def finish_body(self):
+        ''' Called once the whole body has been written. '''
+        if not self.is_buffered() and self.size < self.content_length:
+            self.file.truncate(self.size) # cut off unused preallocation
+        self.file.seek(0)
 
     def finish_header(self):
         self.file = BytesIO()
@@ -330,6 +594,14 @@ class MultipartPart(object):
         self.content_type, options = parse_options_header(ctype)
         self.charset = options.get('charset') or self.charset
         self.content_length = int(self.headers.get('Content-Length','-1'))
+        # File uploads of unknown size may be as large as the whole message
+        if self.content_length >= 0: self.expected_size = self.content_length
+        elif self.filename:          self.expected_size = self.size_hint
+
+    @property
+    def digests(self):
+        ''' Hex digests of the data so far, by hashlib algorithm name '''
+        return dict((name, hash.hexdigest()) for name, hash in self._hashes)
 
     def is_buffered(self):
         ''' Return true if the data is fully buffered in memory.'''
@@ -344,14 +616,38 @@ class MultipartPart(object):
         self.file.seek(pos)
         return val.decode(self.charset)
     
-    def save_as(self, path):
+    def getbuffer(self):
+        ''' A read-only buffer over the raw data: an mmap for parts spooled
+            to disk (close it when done), which doesn't read the file into
+            memory. In-memory parts are copied out of their BytesIO (which
+            has no getbuffer on Python 2) into a memoryview. '''
+        if self.is_buffered() or not self.size:
+            return memoryview(self.file.getvalue() if self.size else tob(''))
+        self.file.flush()
+        return mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def save_as(self, path, link=False):
+        ''' Write the data to :path. With :link, a part spooled to disk is
+            hard-linked into place instead (falling back to a copy if :path
+            is on another filesystem or already exists). '''
+        if link and not self.is_buffered():
+            self.file.flush()
+            try:
+                os.link(self.file.name, path)
+                return self.size
+            except OSError:
+                pass
         fp = open(path, 'wb')
         pos = self.file.tell()
         try:
-            self.file.seek(0)
-            size = copy_file(self.file, fp)
+            if self.is_buffered():
+                fp.write(self.file.getvalue())
+                size = self.size
+            else:
+                size = send_file(self.file, fp, self.size)
         finally:
             self.file.seek(pos)
+            fp.close()
         return size
 
 ##############################################################################
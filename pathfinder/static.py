@@ -0,0 +1,288 @@
+"""pathfinder.static -- a handler for serving the files in a directory
+
+Copyright 2011 Jawbone Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# vim: fileencoding=utf8:et:sta:ai:sw=4:ts=4:sts=4
+
+from __future__ import absolute_import
+
+import collections
+import email.utils
+import mimetypes
+import os
+import re
+import stat
+import threading
+
+from . import Response, FileResponse, _etag_matches, _not_modified_for
+
+
+__all__ = ["StaticFiles"]
+
+_range_re = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class StaticFiles(object):
+    """A handler serving the files under a directory
+
+    Mount it in a :class:`pathfinder.Finder` with a route whose regex
+    captures the path of the file, as a group named ``path`` or as the first
+    group::
+
+        Finder([(r"^/static/(.*)$", {"GET": StaticFiles("/srv/assets")})])
+
+    Recently served files are kept in an LRU cache of up to ``max_entries``
+    files, which is checked against the file's mtime, size and inode on
+    every request. Files of up to ``small_size`` bytes are cached with their
+    contents (``max_bytes`` of them in total), so serving them takes no open
+    or read calls. Larger ones are opened for each request and sent as a
+    :class:`pathfinder.FileResponse`, so by sendfile(2) where the WSGI
+    server supports it. The ETag, Last-Modified and Content-Type of a file
+    are worked out once per version of it.
+
+    ``If-None-Match`` and ``If-Modified-Since`` are answered with 304, and a
+    single byte ``Range`` (subject to ``If-Range``) with 206.
+    """
+    def __init__(self, root, max_entries=256, max_bytes=2**24,
+            small_size=2**16):
+        self.root = os.path.realpath(root)
+        self._prefix = self.root.rstrip(os.sep) + os.sep
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.small_size = small_size
+        self._cache = collections.OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return Response("", code=405, headers=[
+                    ('Allow', 'GET, HEAD'),
+                    ('Content-Length', '0')])
+
+        if 'path' in kwargs:
+            name = kwargs['path']
+        elif args:
+            name = args[0]
+        else:
+            name = request.path
+
+        entry = self.lookup(name or '')
+        if entry is None:
+            return Response("", code=404, headers=[("Content-Length", "0")])
+
+        f = None
+        if entry.content is None:
+            try:
+                f = open(entry.path, 'rb')
+                st = os.fstat(f.fileno())
+            except EnvironmentError:
+                if f is not None:
+                    f.close()
+                return Response("", code=404,
+                        headers=[("Content-Length", "0")])
+            if _version(st) != entry.version:
+                # it changed since the lookup, describe what was opened
+                entry = _entry(entry.path, st, None)
+
+        headers = [
+            ('Content-Type', entry.content_type),
+            ('ETag', entry.etag),
+            ('Last-Modified', entry.last_modified),
+            ('Accept-Ranges', 'bytes'),
+        ]
+        if _not_modified(request, entry):
+            if f is not None:
+                f.close()
+            # the 304 carries the headers of the 200 as it would be sent,
+            # which for large files has an iterable body
+            body = () if entry.content is None else entry.content
+            return _not_modified_for(request, Response(body, headers=headers))
+
+        code, start, end = 200, 0, entry.size
+        if _header(request, 'if-range') in (None, entry.etag,
+                entry.last_modified):
+            rng = _header(request, 'range')
+            rng = rng and _parse_range(rng, entry.size)
+            if rng is False:
+                if f is not None:
+                    f.close()
+                return Response("", code=416, headers=[
+                        ('Content-Range', 'bytes */%d' % entry.size),
+                        ('Content-Length', '0')])
+            if rng:
+                code, (start, end) = 206, rng
+                headers.append(('Content-Range',
+                    'bytes %d-%d/%d' % (start, end - 1, entry.size)))
+        headers.append(('Content-Length', str(end - start)))
+
+        if f is not None:
+            if request.method == 'HEAD':
+                f.close()
+                return Response("", code=code, headers=headers)
+            f.seek(start)
+            return FileResponse(f, code, headers,
+                    None if end == entry.size else end - start)
+
+        body = entry.content
+        if request.method == 'HEAD':
+            body = ""
+        elif code == 206:
+            body = body[start:end]
+        return Response(body, code=code, headers=headers)
+
+    def lookup(self, name):
+        """find the cache entry for a file, (re)loading it as necessary
+
+        ``name`` is the file's path relative to :attr:`root`. returns None
+        if there is no such regular file inside the root directory.
+        """
+        path = os.path.normpath(os.path.join(self.root, name.lstrip('/')))
+        if not path.startswith(self._prefix):
+            return None
+        try:
+            st = os.stat(path)
+        except (EnvironmentError, TypeError, ValueError):
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        version = _version(st)
+
+        with self._lock:
+            entry = self._cache.pop(path, None)
+            if entry is not None:
+                if entry.version == version:
+                    self._cache[path] = entry
+                    return entry
+                self._cached_bytes -= entry.cost
+
+        entry = self._load(path)
+        if entry is None:
+            return None
+
+        with self._lock:
+            old = self._cache.pop(path, None)
+            if old is not None:
+                self._cached_bytes -= old.cost
+            self._cache[path] = entry
+            self._cached_bytes += entry.cost
+            while len(self._cache) > self.max_entries or \
+                    self._cached_bytes > self.max_bytes:
+                old = self._cache.popitem(last=False)[1]
+                self._cached_bytes -= old.cost
+
+        return entry
+
+    def clear(self):
+        "empty the cache"
+        with self._lock:
+            self._cache.clear()
+            self._cached_bytes = 0
+
+    def _load(self, path):
+        try:
+            f = open(path, 'rb')
+        except EnvironmentError:
+            return None
+        try:
+            st = os.fstat(f.fileno())
+            content = None
+            if st.st_size <= self.small_size:
+                content = f.read()
+        finally:
+            f.close()
+        return _entry(path, st, content)
+
+
+class _cached_file(collections.namedtuple('_cached_file',
+        ('path', 'version', 'mtime', 'size', 'etag', 'last_modified',
+            'content_type', 'content'))):
+    __slots__ = ()
+
+    @property
+    def cost(self):
+        "the bytes of memory taken up by the cached contents"
+        return 0 if self.content is None else len(self.content)
+
+
+def _version(st):
+    return st.st_mtime, st.st_size, st.st_ino
+
+
+def _entry(path, st, content):
+    # the cache entry for a file from its stat result, with its contents
+    # for small files (None for large ones, which are opened when served)
+    return _cached_file(
+            path,
+            _version(st),
+            int(st.st_mtime),
+            st.st_size,
+            '"%x-%x"' % (int(st.st_mtime * 1000000), st.st_size),
+            email.utils.formatdate(st.st_mtime, usegmt=True),
+            mimetypes.guess_type(path)[0] or 'application/octet-stream',
+            content)
+
+
+def _header(request, name):
+    # Finder.wsgi splits header values on commas, so put them back together
+    values = request.headers.getall(name)
+    if not values:
+        return None
+    return ",".join(values).strip()
+
+
+def _parse_date(value):
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return email.utils.mktime_tz(parsed)
+
+
+def _not_modified(request, entry):
+    if request.headers.get('if-none-match') is not None:
+        return _etag_matches(request, entry.etag)
+
+    since = _header(request, 'if-modified-since')
+    if since is not None:
+        since = _parse_date(since)
+        return since is not None and entry.mtime <= since
+
+    return False
+
+
+def _parse_range(value, size):
+    # returns (start, end) for a satisfiable range, False for an
+    # unsatisfiable one, and None for anything that should be ignored
+    # (including multiple ranges, which get the whole file)
+    match = _range_re.match(value)
+    if match is None:
+        return None
+    first, last = match.groups()
+
+    if first:
+        start = int(first)
+        end = int(last) + 1 if last else size
+        if last and end <= start:
+            return None
+        if start >= size:
+            return False
+        return start, min(end, size)
+
+    if not last:
+        return None
+    suffix = int(last)
+    if not suffix:
+        return False
+    return max(size - suffix, 0), size
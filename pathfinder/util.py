@@ -17,11 +17,44 @@ limitations under the License.
 # vim: fileencoding=utf8:et:sta:ai:sw=4:ts=4:sts=4
 
 import collections
+import itertools
 
 
-__all__ = ["OrderedMultiDict", "CaseInsensitiveOrderedMultiDict"]
+__all__ = ["OrderedMultiDict", "CaseInsensitiveOrderedMultiDict",
+        "ChainedMultiDict", "FrozenCaseInsensitiveMultiDict"]
 
 _notset = object()
+_deleted = object()
+
+
+# header names common enough that it's worth never lowercasing them again.
+# lower_header_names maps the usual spellings of each to one interned
+# lowercase string, so the case-insensitive dicts below skip str.lower() for
+# them and their indexes compare keys by identity. environ_header_names does
+# the same for the CGI-style keys in a WSGI environ (HTTP_CONTENT_TYPE etc).
+_COMMON_HEADERS = (
+    "Accept", "Accept-Charset", "Accept-Encoding", "Accept-Language",
+    "Accept-Ranges", "Age", "Allow", "Authorization", "Cache-Control",
+    "Connection", "Content-Disposition", "Content-Encoding",
+    "Content-Language", "Content-Length", "Content-Location", "Content-MD5",
+    "Content-Range", "Content-Type", "Cookie", "Date", "ETag", "Expect",
+    "Expires", "From", "Host", "If-Match", "If-Modified-Since",
+    "If-None-Match", "If-Range", "If-Unmodified-Since", "Keep-Alive",
+    "Last-Modified", "Location", "Origin", "Pragma", "Range", "Referer",
+    "Server", "Set-Cookie", "TE", "Trailer", "Transfer-Encoding", "Upgrade",
+    "User-Agent", "Vary", "Via", "WWW-Authenticate", "X-Forwarded-For",
+    "X-Forwarded-Host", "X-Forwarded-Proto", "X-Real-IP",
+    "X-Requested-With")
+
+lower_header_names = {}
+environ_header_names = {}
+for _name in _COMMON_HEADERS:
+    _lower = intern(_name.lower())
+    for _spelling in (_name, _name.title(), _lower):
+        lower_header_names[intern(_spelling)] = _lower
+    environ_header_names["HTTP_" + _name.upper().replace('-', '_')] = _lower
+del _name, _lower, _spelling
+_lowered = lower_header_names
 
 
 class OrderedMultiDict(collections.MutableMapping):
@@ -31,16 +64,21 @@ class OrderedMultiDict(collections.MutableMapping):
     - maintains a total ordering for all values
     '''
 
-    # reasonable performance on the wide variety of dictionary operations are
-    # supported by the datastructure underlying this object: a doubly linked
-    # list of nodes with (key, value) pairs, and a dict mapping keys straight
-    # to nodes
+    # the entries are kept in a pair of parallel lists of keys and values, so
+    # iteration and bulk construction run at list speed. a dict maps each key
+    # to the (ascending) list indexes of its entries. removed entries leave a
+    # tombstone in the key list, and the lists are compacted once more than
+    # half of their slots are tombstones. copy() shares all of this storage
+    # with the new dict, and whichever dict is modified first takes private
+    # copies of it
 
     def __init__(self, *args, **kwargs):
-        self._dict = collections.defaultdict(list)
-        self._head = None # need this for pop()ing latest item
-        self._tail = None # need this for iteration starting point
-        self._len = 0     # need this for a constant-time __len__
+        self._keys = []
+        self._values = []
+        self._index = {}
+        self._len = 0  # live entries, for a constant-time __len__
+        self._dead = 0 # tombstones in the lists
+        self._shared = False # storage is shared with a copy
 
         self.update(*args, **kwargs)
 
@@ -49,39 +87,37 @@ class OrderedMultiDict(collections.MutableMapping):
 
     def __iter__(self):
         "iteration is done in order"
-        for node in self._iternodes():
-            yield node.key
+        for key in self._keys:
+            if key is not _deleted:
+                yield key
 
     def __contains__(self, key):
-        return key in self._dict
+        return key in self._index
 
     has_key = __contains__
 
     def __getitem__(self, key):
         "returns only the last value for the provided key"
-        if key not in self._dict:
+        if key not in self._index:
             raise KeyError(key)
-        return self._dict[key][-1].value
+        return self._values[self._index[key][-1]]
 
     def __setitem__(self, key, value):
         "effectively appends to the list of values for a key"
-        node = _OMDNode()
-        node.key = key
-        node.value = value
-        if not self._head:
-            self._head = node
-            node.prev = None
+        if self._shared:
+            self._unshare()
+        indexes = self._index.get(key)
+        if indexes is None:
+            self._index[key] = [len(self._keys)]
         else:
-            node.prev = self._tail
-            self._tail.next = node
-        node.next = None
-        self._tail = node
-        self._dict[key].append(node)
+            indexes.append(len(self._keys))
+        self._keys.append(key)
+        self._values.append(value)
         self._len += 1
 
     def __delitem__(self, key):
         "only removes the last value for a given key"
-        if key not in self._dict:
+        if key not in self._index:
             raise KeyError(key)
         self._remove_last_item(key)
 
@@ -92,23 +128,36 @@ class OrderedMultiDict(collections.MutableMapping):
     __str__ = __repr__
 
     def clear(self):
-        self._dict.clear()
-        self._head = None
-        self._tail = None
+        self._keys = []
+        self._values = []
+        self._index = {}
         self._len = 0
+        self._dead = 0
+        self._shared = False
 
     def copy(self):
-        return type(self)(self)
+        "constant-time, the storage is only copied once either is modified"
+        omd = type(self).__new__(type(self))
+        omd.__dict__.update(self.__dict__)
+        self._shared = omd._shared = True
+        return omd
+
+    @classmethod
+    def fromitems(cls, pairs):
+        "build from a sequence of key/value pairs, indexing them in one pass"
+        omd = cls()
+        omd._extend(pairs)
+        return omd
 
     def get(self, key, default=None):
         "only gets a the last value for the given key"
-        if key not in self._dict:
+        if key not in self._index:
             return default
-        return self._dict[key][-1].value
+        return self._values[self._index[key][-1]]
 
     def pop(self, key, default=_notset):
         "only pops a single value for the key, others may remain"
-        if key not in self._dict:
+        if key not in self._index:
             if default is _notset:
                 raise KeyError(key)
             return default
@@ -118,14 +167,14 @@ class OrderedMultiDict(collections.MutableMapping):
         "pops a single key/value pair, other values for the key may remain"
         # only pops a single (key, value) pair,
         # other values for the key may remain
-        if not self._tail:
+        if not self._len:
             raise KeyError("OrderedMultiDict is empty")
-        key = self._tail.key
+        key = self._keys[-1]
         return key, self._remove_last_item(key)
 
     def setdefault(self, key, value=None):
-        if key in self._dict:
-            return self._dict[key][-1].value
+        if key in self._index:
+            return self._values[self._index[key][-1]]
         self[key] = value
         return value
 
@@ -133,30 +182,31 @@ class OrderedMultiDict(collections.MutableMapping):
         "preserves order if the argument is a list of two-tuples"
         if args:
             arg = args[0]
-            if isinstance(arg, collections.MutableMapping):
+            if isinstance(arg, collections.Mapping):
                 arg = arg.iteritems()
-            for key, value in arg:
-                self[key] = value
-        for key, value in kwargs.iteritems():
-            self[key] = value
+            self._extend(arg)
+        if kwargs:
+            self._extend(kwargs.iteritems())
 
     def iterkeys(self):
         "iterator over the keys in order, but skipping duplicates"
         shown = set()
-        for node in self._iternodes():
-            if node.key not in shown:
-                yield node.key
-                shown.add(node.key)
+        for key in self._keys:
+            if key is not _deleted and key not in shown:
+                yield key
+                shown.add(key)
 
     def itervalues(self):
         "iterator over all values in order"
-        for node in self._iternodes():
-            yield node.value
+        for key, value in itertools.izip(self._keys, self._values):
+            if key is not _deleted:
+                yield value
 
     def iteritems(self):
         "iterator over all key/value pairs in order"
-        for node in self._iternodes():
-            yield node.key, node.value
+        for pair in itertools.izip(self._keys, self._values):
+            if pair[0] is not _deleted:
+                yield pair
 
     def keys(self):
         "produces all keys in order, skipping duplicates"
@@ -164,10 +214,14 @@ class OrderedMultiDict(collections.MutableMapping):
 
     def values(self):
         "produces all values in order"
+        if not self._dead:
+            return self._values[:]
         return list(self.itervalues())
 
     def items(self):
         "produces all key/value pairs in order"
+        if not self._dead:
+            return zip(self._keys, self._values)
         return list(self.iteritems())
 
     #
@@ -175,20 +229,22 @@ class OrderedMultiDict(collections.MutableMapping):
     #
     def itergetall(self, key):
         "iterator over all the values for a given key in order"
-        for node in self._dict.get(key, ()):
-            yield node.value
+        values = self._values
+        for i in self._index.get(key, ()):
+            yield values[i]
 
     def getall(self, key):
         "produces all the values for a given key in order"
-        return list(self.itergetall(key))
+        values = self._values
+        return [values[i] for i in self._index.get(key, ())]
 
     def iterlastitems(self):
         "iterator producing key/value pairs in order with no duplicate keys"
         shown = set()
-        for node in self._iternodes():
-            if node.key not in shown:
-                yield node.key, self._dict[node.key][-1].value
-                shown.add(node.key)
+        for key in self._keys:
+            if key is not _deleted and key not in shown:
+                yield key, self._values[self._index[key][-1]]
+                shown.add(key)
 
     def lastitems(self):
         "produces a list of key/value pairs in order with no duplicate keys"
@@ -198,48 +254,104 @@ class OrderedMultiDict(collections.MutableMapping):
         "remove all values present for a particular key"
         # there is no iter-version because this implementation
         # wouldn't play nice with mutation between iterations
-        result = []
-        for node in self._dict.pop(key, ()):
-            self._remove_node(node)
-            result.append(node.value)
+        if self._shared:
+            self._unshare()
+        indexes = self._index.pop(key, ())
+        result = [self._values[i] for i in indexes]
+        for i in indexes:
+            self._remove_index(i)
+        self._collect()
         return result
 
     def popitemall(self):
         "remove all values for whichever key comes last in order"
-        if not self._tail:
+        if not self._len:
             raise KeyError("OrderedMultiDict is empty")
-        key = self._tail.key
-        return key, self.popall(self._tail.key)
+        key = self._keys[-1]
+        return key, self.popall(key)
 
     def replace(self, key, value):
         "set a value for a key, removing all existing values"
-        for node in self._dict.pop(key, ()):
-            self._remove_node(node)
+        if self._shared:
+            self._unshare()
+        for i in self._index.pop(key, ()):
+            self._remove_index(i)
+        self._collect()
         self[key] = value
 
-    def _remove_node(self, node):
+    def _extend(self, pairs):
+        # the bulk version of __setitem__ (so subclasses overriding that will
+        # want to override this too)
+        pairs = list(pairs)
+        if not pairs:
+            return
+        if self._shared:
+            self._unshare()
+        keys, values = zip(*pairs)
+        index = self._index
+        for i, key in enumerate(keys, len(self._keys)):
+            indexes = index.get(key)
+            if indexes is None:
+                index[key] = [i]
+            else:
+                indexes.append(i)
+        self._keys.extend(keys)
+        self._values.extend(values)
+        self._len += len(keys)
+
+    def _unshare(self):
+        # take private copies of the storage shared with a copy()
+        self._keys = self._keys[:]
+        self._values = self._values[:]
+        self._index = dict((k, v[:]) for k, v in self._index.iteritems())
+        self._shared = False
+
+    def _remove_index(self, i):
+        # leaves the index and any compaction to the caller
+        self._keys[i] = _deleted
+        self._values[i] = None
         self._len -= 1
-        if node.prev:
-            node.prev.next = node.next
-        else:
-            self._head = node.next
-        if node.next:
-            node.next.prev = node.prev
-        else:
-            self._tail = node.prev
+        self._dead += 1
+
+    def _collect(self):
+        # drop trailing tombstones so the last entry is always live, and
+        # compact when tombstones take up more than half of the lists
+        keys, values = self._keys, self._values
+        while keys and keys[-1] is _deleted:
+            keys.pop()
+            values.pop()
+            self._dead -= 1
+        if self._dead > 8 and self._dead * 2 > len(keys):
+            self._compact()
+
+    def _compact(self):
+        # builds new lists rather than mutating, so iterators already running
+        # over the old ones aren't thrown off
+        keys, values, index = [], [], {}
+        for key, value in itertools.izip(self._keys, self._values):
+            if key is _deleted:
+                continue
+            indexes = index.get(key)
+            if indexes is None:
+                index[key] = [len(keys)]
+            else:
+                indexes.append(len(keys))
+            keys.append(key)
+            values.append(value)
+        self._keys, self._values, self._index = keys, values, index
+        self._dead = 0
 
     def _remove_last_item(self, key):
-        node = self._dict[key].pop()
-        if not self._dict[key]:
-            del self._dict[key]
-        self._remove_node(node)
-        return node.value
-
-    def _iternodes(self):
-        node = self._head
-        while node:
-            yield node
-            node = node.next
+        if self._shared:
+            self._unshare()
+        indexes = self._index[key]
+        i = indexes.pop()
+        if not indexes:
+            del self._index[key]
+        value = self._values[i]
+        self._remove_index(i)
+        self._collect()
+        return value
 
 
 class CaseInsensitiveOrderedMultiDict(OrderedMultiDict):
@@ -254,11 +366,12 @@ class CaseInsensitiveOrderedMultiDict(OrderedMultiDict):
 
     def __contains__(self, key):
         "checks case-insensitively for presence of the key"
-        return key.lower() in self._casemap
+        return (_lowered[key] if key in _lowered else key.lower()) \
+                in self._casemap
 
     def __getitem__(self, key):
         "retrieves the last value for any key that matches case-insensitively"
-        key = key.lower()
+        key = _lowered[key] if key in _lowered else key.lower()
         if key not in self._casemap:
             raise KeyError(key)
         key = self._casemap[key][0][-1]
@@ -266,25 +379,37 @@ class CaseInsensitiveOrderedMultiDict(OrderedMultiDict):
 
     def __setitem__(self, key, value):
         super(CaseInsensitiveOrderedMultiDict, self).__setitem__(key, value)
-        lst, st = self._casemap[key.lower()]
+        lower = _lowered[key] if key in _lowered else key.lower()
+        lst, st = self._casemap[lower]
         if key not in st:
             st.add(key)
             lst.append(key)
 
+    def _extend(self, pairs):
+        pairs = list(pairs)
+        super(CaseInsensitiveOrderedMultiDict, self)._extend(pairs)
+        casemap = self._casemap
+        for key, value in pairs:
+            lower = _lowered[key] if key in _lowered else key.lower()
+            lst, st = casemap[lower]
+            if key not in st:
+                st.add(key)
+                lst.append(key)
+
     def __delitem__(self, key):
         "deletes the last value for any key that matches case-insensitively"
-        lower = key.lower()
+        lower = _lowered[key] if key in _lowered else key.lower()
         if lower in self._casemap:
             key = self._casemap[lower][0][-1]
         super(CaseInsensitiveOrderedMultiDict, self).__delitem__(key)
 
     def clear(self):
         super(CaseInsensitiveOrderedMultiDict, self).clear()
-        self._casemap.clear()
+        self._casemap = collections.defaultdict(lambda: ([], set()))
 
     def get(self, key, default=None):
         "retrieves the last value for any key that matches case-insensitively"
-        key = key.lower()
+        key = _lowered[key] if key in _lowered else key.lower()
         if key not in self._casemap:
             return default
         key = self._casemap[key][0][-1]
@@ -292,7 +417,7 @@ class CaseInsensitiveOrderedMultiDict(OrderedMultiDict):
 
     def pop(self, key, default=_notset):
         "pops the last value for any key that matches case-insensitively"
-        lower = key.lower()
+        lower = _lowered[key] if key in _lowered else key.lower()
         if lower not in self._casemap:
             if default is _notset:
                 raise KeyError(key)
@@ -302,7 +427,7 @@ class CaseInsensitiveOrderedMultiDict(OrderedMultiDict):
 
     def setdefault(self, key, value=None):
         "the check for presence of the key is case-insensitive"
-        lower = key.lower()
+        lower = _lowered[key] if key in _lowered else key.lower()
         if lower in self._casemap:
             key = self._casemap[lower][0][-1]
         return super(CaseInsensitiveOrderedMultiDict,
@@ -310,15 +435,21 @@ class CaseInsensitiveOrderedMultiDict(OrderedMultiDict):
 
     def itergetall(self, key):
         "gets all values for all keys which case-insensitively match"
-        lower = key.lower()
+        lower = _lowered[key] if key in _lowered else key.lower()
         for key in self._casemap.get(lower, [()])[0]:
             for value in super(CaseInsensitiveOrderedMultiDict,
                     self).itergetall(key):
                 yield value
 
+    def getall(self, key):
+        "gets all values for all keys which case-insensitively match"
+        return list(self.itergetall(key))
+
     def popall(self, key):
         "pops all values for all keys which case-insensitively match"
-        lower = key.lower()
+        if self._shared:
+            self._unshare()
+        lower = _lowered[key] if key in _lowered else key.lower()
         lst, st = self._casemap.pop(lower)
         results = []
         for key in lst:
@@ -328,7 +459,9 @@ class CaseInsensitiveOrderedMultiDict(OrderedMultiDict):
 
     def replace(self, key, value):
         "replace all case-insensitively matching key/value pairs"
-        lower = key.lower()
+        if self._shared:
+            self._unshare()
+        lower = _lowered[key] if key in _lowered else key.lower()
         if lower in self._casemap:
             for key_option in self._casemap[lower][0]:
                 super(CaseInsensitiveOrderedMultiDict,
@@ -336,27 +469,245 @@ class CaseInsensitiveOrderedMultiDict(OrderedMultiDict):
         self._casemap[lower] = ([key], set([key]))
         super(CaseInsensitiveOrderedMultiDict, self).__setitem__(key, value)
 
+    def _unshare(self):
+        casemap = collections.defaultdict(lambda: ([], set()))
+        for lower, (lst, st) in self._casemap.iteritems():
+            casemap[lower] = (lst[:], set(st))
+        self._casemap = casemap
+        super(CaseInsensitiveOrderedMultiDict, self)._unshare()
+
     def _remove_last_item(self, key):
-        lower = key.lower()
+        if self._shared:
+            self._unshare()
+        lower = _lowered[key] if key in _lowered else key.lower()
         lst, st = self._casemap[lower]
         key = lst[-1]
         value = super(CaseInsensitiveOrderedMultiDict,
                 self)._remove_last_item(key)
-        if key not in self._dict:
+        if key not in self._index:
             lst.pop()
             st.remove(key)
             if not lst:
                 del self._casemap[lower]
         return value
 
-class _OMDNode(object):
-    __slots__ = ["prev", "next", "key", "value"]
 
-    def _reprshort(self):
-        return '(%r: %r)' % (self.key, self.value)
+class ChainedMultiDict(collections.Mapping):
+    '''A read-only view over several OrderedMultiDicts as though merged
+
+    it behaves like a copy of the first dict updated with each of the
+    others in turn, but reads go straight through to the underlying dicts,
+    so it never goes stale and nothing is copied
+    '''
+    def __init__(self, *omds):
+        self._omds = omds
+
+    def __len__(self):
+        return sum(len(omd) for omd in self._omds)
+
+    def __iter__(self):
+        "iteration is done in order"
+        return itertools.chain(*self._omds)
+
+    def __contains__(self, key):
+        for omd in self._omds:
+            if key in omd:
+                return True
+        return False
+
+    has_key = __contains__
+
+    def __getitem__(self, key):
+        "returns only the last value for the provided key"
+        for omd in reversed(self._omds):
+            if key in omd:
+                return omd[key]
+        raise KeyError(key)
+
+    def __repr__(self):
+        return "{%s}" % (
+                ', '.join('%r: %r' % (k, v) for k, v in self.iteritems()))
+
+    __str__ = __repr__
+
+    def copy(self):
+        "produces a (mutable) OrderedMultiDict of the merged contents"
+        return OrderedMultiDict.fromitems(self.iteritems())
+
+    def get(self, key, default=None):
+        "only gets a the last value for the given key"
+        for omd in reversed(self._omds):
+            if key in omd:
+                return omd[key]
+        return default
+
+    def iterkeys(self):
+        "iterator over the keys in order, but skipping duplicates"
+        shown = set()
+        for key in self:
+            if key not in shown:
+                yield key
+                shown.add(key)
+
+    def itervalues(self):
+        "iterator over all values in order"
+        return itertools.chain(*(omd.itervalues() for omd in self._omds))
+
+    def iteritems(self):
+        "iterator over all key/value pairs in order"
+        return itertools.chain(*(omd.iteritems() for omd in self._omds))
+
+    def keys(self):
+        "produces all keys in order, skipping duplicates"
+        return list(self.iterkeys())
+
+    def values(self):
+        "produces all values in order"
+        return list(self.itervalues())
+
+    def items(self):
+        "produces all key/value pairs in order"
+        return list(self.iteritems())
+
+    def itergetall(self, key):
+        "iterator over all the values for a given key in order"
+        for omd in self._omds:
+            for value in omd.itergetall(key):
+                yield value
+
+    def getall(self, key):
+        "produces all the values for a given key in order"
+        return list(self.itergetall(key))
+
+    def iterlastitems(self):
+        "iterator producing key/value pairs in order with no duplicate keys"
+        for key in self.iterkeys():
+            yield key, self[key]
+
+    def lastitems(self):
+        "produces a list of key/value pairs in order with no duplicate keys"
+        return list(self.iterlastitems())
+
+
+class FrozenCaseInsensitiveMultiDict(collections.Mapping):
+    '''An immutable, hashable CaseInsensitiveOrderedMultiDict
+
+    for collections like parsed request headers which are never modified.
+    the pairs are stored in a tuple, and an index from lowercased keys to
+    their values is built once up front, so there is nothing to maintain.
+
+    unlike CaseInsensitiveOrderedMultiDict, lookups by any spelling of a key
+    find the values of all its spellings in their original order
+    '''
+    def __init__(self, pairs=()):
+        if isinstance(pairs, collections.Mapping):
+            pairs = pairs.iteritems()
+        self._items = items = tuple(pairs)
+        self._index = index = {}
+        for key, value in items:
+            lower = _lowered[key] if key in _lowered else key.lower()
+            values = index.get(lower)
+            if values is None:
+                index[lower] = [value]
+            else:
+                values.append(value)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        "iteration is done in order"
+        for key, value in self._items:
+            yield key
+
+    def __contains__(self, key):
+        "checks case-insensitively for presence of the key"
+        return (_lowered[key] if key in _lowered else key.lower()) \
+                in self._index
+
+    has_key = __contains__
+
+    def __getitem__(self, key):
+        "retrieves the last value for any key that matches case-insensitively"
+        lower = _lowered[key] if key in _lowered else key.lower()
+        values = self._index.get(lower)
+        if values is None:
+            raise KeyError(key)
+        return values[-1]
+
+    def __hash__(self):
+        return hash(self._items)
+
+    def __eq__(self, other):
+        if isinstance(other, FrozenCaseInsensitiveMultiDict):
+            return self._items == other._items
+        return super(FrozenCaseInsensitiveMultiDict, self).__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
 
     def __repr__(self):
-        return '_OMDNode(prev=%s, next=%s, keyval=%s)' % (
-                self.prev._reprshort() if self.prev else 'None',
-                self.next._reprshort() if self.next else 'None',
-                self._reprshort())
+        return "{%s}" % (
+                ', '.join('%r: %r' % (k, v) for k, v in self._items))
+
+    __str__ = __repr__
+
+    def copy(self):
+        "produces a (mutable) CaseInsensitiveOrderedMultiDict of the contents"
+        return CaseInsensitiveOrderedMultiDict.fromitems(self._items)
+
+    def get(self, key, default=None):
+        "retrieves the last value for any key that matches case-insensitively"
+        lower = _lowered[key] if key in _lowered else key.lower()
+        values = self._index.get(lower)
+        if values is None:
+            return default
+        return values[-1]
+
+    def iterkeys(self):
+        "iterator over the keys in order, but skipping duplicates"
+        shown = set()
+        for key, value in self._items:
+            if key not in shown:
+                yield key
+                shown.add(key)
+
+    def itervalues(self):
+        "iterator over all values in order"
+        for key, value in self._items:
+            yield value
+
+    def iteritems(self):
+        "iterator over all key/value pairs in order"
+        return iter(self._items)
+
+    def keys(self):
+        "produces all keys in order, skipping duplicates"
+        return list(self.iterkeys())
+
+    def values(self):
+        "produces all values in order"
+        return [value for key, value in self._items]
+
+    def items(self):
+        "produces all key/value pairs in order"
+        return list(self._items)
+
+    def itergetall(self, key):
+        "iterator over all values for keys which case-insensitively match"
+        lower = _lowered[key] if key in _lowered else key.lower()
+        return iter(self._index.get(lower, ()))
+
+    def getall(self, key):
+        "produces all values for keys which case-insensitively match"
+        lower = _lowered[key] if key in _lowered else key.lower()
+        return list(self._index.get(lower, ()))
+
+    def iterlastitems(self):
+        "iterator producing key/value pairs in order with no duplicate keys"
+        for key in self.iterkeys():
+            yield key, self[key]
+
+    def lastitems(self):
+        "produces a list of key/value pairs in order with no duplicate keys"
+        return list(self.iterlastitems())
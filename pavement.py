@@ -59,3 +59,7 @@ def docs():
 @task
 def test():
     sh("nosetests test/unit test/functional")
+
+@task
+def bench():
+    sh("python test/bench/bench_multipart.py")
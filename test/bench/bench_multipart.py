@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# vim: fileencoding=utf8:et:sta:ai:sw=4:ts=4:sts=4
+"""throughput and peak memory of pathfinder.multipart.MultipartParser
+
+each case runs in a forked child so that its peak RSS is its own. run it
+from the repository root:
+
+    python test/bench/bench_multipart.py [repeats]
+"""
+
+import os
+import random
+import resource
+import sys
+import time
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', '..'))
+sys.path.insert(0, os.path.join(here, '..', 'unit'))
+
+import pathfinder.multipart
+from test_multipart_fuzz import make_message
+
+
+KB, MB = 2**10, 2**20
+
+# (part count, part size, boundary length, newline density)
+CASES = [
+    (100, 1 * KB, 16, 0.01),
+    (10, 64 * KB, 16, 0),
+    (10, 64 * KB, 16, 0.01),
+    (1, 8 * MB, 16, 0),
+    (1, 8 * MB, 16, 0.001),
+    (1, 8 * MB, 16, 0.05),
+    (1, 8 * MB, 70, 0.05),
+    (4, 8 * MB, 1, 0.05),
+]
+
+
+def run_case(case, repeats):
+    "parse the case's message and return (MB/s, peak RSS growth in KB)"
+    boundary, body, expected = make_message(random.Random(0), *case)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    for i in xrange(repeats):
+        parser = pathfinder.multipart.MultipartParser(
+                StringIO(body), boundary, len(body),
+                disk_limit=2**32, mem_limit=2**28, memfile_limit=2**18)
+        for part in parser:
+            pass
+    elapsed = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    return repeats * len(body) / elapsed / MB, peak
+
+
+def run_forked(case, repeats):
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(rfd)
+        os.write(wfd, "%f %d" % run_case(case, repeats))
+        os._exit(0)
+    os.close(wfd)
+    result = os.read(rfd, 128)
+    os.close(rfd)
+    os.waitpid(pid, 0)
+    rate, peak = result.split()
+    return float(rate), int(peak)
+
+
+def main(environ, argv):
+    repeats = int(argv[1]) if len(argv) > 1 else 3
+    print "%6s %10s %9s %8s %10s %10s" % (
+            "parts", "part size", "boundary", "newline", "MB/s", "peak KB")
+    for case in CASES:
+        rate, peak = run_forked(case, repeats)
+        print "%6d %10d %9d %8g %10.1f %10d" % (case + (rate, peak))
+
+
+if __name__ == '__main__':
+    exit(main(os.environ, sys.argv))
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# vim: fileencoding=utf8:et:sta:ai:sw=4:ts=4:sts=4
+
+import os
+import time
+import unittest
+
+import pathfinder
+import pathfinder.cache
+from test_finder import fake_wsgi_request, fake_gevent_http_request
+
+
+class ResponseCacheTests(object):
+    def setUp(self):
+        self.calls = []
+
+    def handler(self, request):
+        self.calls.append(request.path)
+        return "hello %d" % len(self.calls)
+
+    def finder(self, cache, handler=None):
+        return pathfinder.Finder([
+            (r"^/\w+$", handler or self.handler, {'cache': cache}),
+        ])
+
+    def get(self, finder, path="/foo", headers=None, method="GET"):
+        return self.fake_request(finder, method, path, headers)['body']
+
+    def test_hits(self):
+        finder = self.finder(pathfinder.cache.ResponseCache())
+        self.assertEqual(self.get(finder), "hello 1")
+        self.assertEqual(self.get(finder), "hello 1")
+        self.assertEqual(self.get(finder, "/foo?a=1"), "hello 2")
+        self.assertEqual(self.get(finder, "/bar"), "hello 3")
+        self.assertEqual(self.get(finder, "/foo?a=1"), "hello 2")
+        self.assertEqual(len(self.calls), 3)
+
+    def test_get_only(self):
+        finder = self.finder(pathfinder.cache.ResponseCache())
+        self.assertEqual(self.get(finder, method="POST"), "hello 1")
+        self.assertEqual(self.get(finder, method="POST"), "hello 2")
+        self.assertEqual(self.get(finder), "hello 3")
+
+    def test_ttl(self):
+        finder = self.finder(pathfinder.cache.ResponseCache(ttl=0.05))
+        self.assertEqual(self.get(finder), "hello 1")
+        self.assertEqual(self.get(finder), "hello 1")
+        time.sleep(0.1)
+        self.assertEqual(self.get(finder), "hello 2")
+
+    def test_vary(self):
+        finder = self.finder(
+                pathfinder.cache.ResponseCache(vary=['Accept-Language']))
+        self.assertEqual(self.get(finder), "hello 1")
+        self.assertEqual(self.get(finder, headers={'accept-language': 'de'}),
+                "hello 2")
+        self.assertEqual(self.get(finder, headers={'Accept-Language': 'de'}),
+                "hello 2")
+        self.assertEqual(self.get(finder), "hello 1")
+        self.assertEqual(self.get(finder, headers={'Authorization': 'x'}),
+                "hello 3")
+        self.assertEqual(self.get(finder, headers={'Cookie': 'u=bob'}),
+                "hello 4")
+        self.assertEqual(self.get(finder, headers={'Cookie': 'u=bob'}),
+                "hello 5")
+
+        finder = self.finder(pathfinder.cache.ResponseCache(vary=['Cookie']))
+        self.assertEqual(self.get(finder, headers={'Cookie': 'u=bob'}),
+                "hello 6")
+        self.assertEqual(self.get(finder, headers={'Cookie': 'u=bob'}),
+                "hello 6")
+        self.assertEqual(self.get(finder, headers={'Cookie': 'u=alice'}),
+                "hello 7")
+
+    def test_uncacheable_responses(self):
+        def handler(request, headers=()):
+            response = pathfinder.Response(self.handler(request),
+                    headers=headers)
+            if request.path == "/cookie":
+                response.cookies['a'] = 'b'
+            return response
+        options = {'cache': pathfinder.cache.ResponseCache()}
+        finder = pathfinder.Finder([
+            (r"^/cookie$", handler, options),
+            (r"^/private$", lambda request: handler(request,
+                [('Cache-Control', 'private, max-age=60')]), options),
+            (r"^/vary$", lambda request: handler(request,
+                [('Vary', 'Cookie')]), options),
+            (r"^/error$", lambda request: pathfinder.Response(
+                self.handler(request), code=503), options),
+        ])
+        for i, path in enumerate(["/cookie", "/private", "/vary", "/error"]):
+            self.assertEqual(self.get(finder, path), "hello %d" % (2*i + 1))
+            self.assertEqual(self.get(finder, path), "hello %d" % (2*i + 2))
+
+    def test_invalidate(self):
+        cache = pathfinder.cache.ResponseCache()
+        finder = self.finder(cache)
+        self.get(finder)
+        self.get(finder, "/foo?a=1")
+        self.get(finder, "/bar")
+        cache.invalidate("/foo")
+        self.assertEqual(self.get(finder), "hello 4")
+        self.assertEqual(self.get(finder, "/foo?a=1"), "hello 5")
+        self.assertEqual(self.get(finder, "/bar"), "hello 3")
+        cache.clear()
+        self.assertEqual(self.get(finder, "/bar"), "hello 6")
+
+    def test_conditional_hits(self):
+        finder = pathfinder.Finder([
+            (r"^/foo$", self.handler,
+                {'cache': pathfinder.cache.ResponseCache()}),
+        ], conditional=True)
+        response = self.fake_request(finder, "GET", "/foo")
+        etag = dict(response['headers'])['ETag']
+        response = self.fake_request(finder, "GET", "/foo",
+                {'If-None-Match': etag})
+        self.assertEqual(response['code'], 304)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_shared_memory_backend(self):
+        cache = pathfinder.cache.ResponseCache(
+                backend=pathfinder.cache.SharedMemoryBackend(slots=16))
+        finder = self.finder(cache)
+        self.assertEqual(self.get(finder), "hello 1")
+        self.assertEqual(self.get(finder), "hello 1")
+
+        pid = os.fork()
+        if not pid:
+            # the child process' handler would produce "hello 2"
+            status = 0 if self.get(finder) == "hello 1" and \
+                    self.get(finder, "/bar") == "hello 2" else 1
+            os._exit(status)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.assertEqual(self.get(finder, "/bar"), "hello 2")
+        self.assertEqual(len(self.calls), 1)
+
+
+class ResponseCacheOnGeventHTTPTests(ResponseCacheTests, unittest.TestCase):
+    fake_request = staticmethod(fake_gevent_http_request)
+
+
+class ResponseCacheOnWSGITests(ResponseCacheTests, unittest.TestCase):
+    fake_request = staticmethod(fake_wsgi_request)
+
+
+class BackendTests(object):
+    def response(self, body):
+        return pathfinder.StaticResponse(body)
+
+    def test_set_get(self):
+        self.backend.set("a", "g", self.response("one"), 10)
+        self.backend.set("b", "g", self.response("two"), 10)
+        self.assertEqual(self.backend.get("a").content, "one")
+        self.assertEqual(self.backend.get("b").headers['content-length'], '3')
+        self.assertIsNone(self.backend.get("c"))
+
+        self.backend.set("a", "g", self.response("three"), 10)
+        self.assertEqual(self.backend.get("a").content, "three")
+
+    def test_expiry(self):
+        self.backend.set("a", "g", self.response("one"), -1)
+        self.assertIsNone(self.backend.get("a"))
+
+    def test_groups(self):
+        self.backend.set("a", "g", self.response("one"), 10)
+        self.backend.set("b", "g", self.response("two"), 10)
+        self.backend.set("c", "h", self.response("three"), 10)
+        self.backend.delete_group("g")
+        self.backend.delete_group("nothing")
+        self.assertIsNone(self.backend.get("a"))
+        self.assertIsNone(self.backend.get("b"))
+        self.assertEqual(self.backend.get("c").content, "three")
+        self.backend.clear()
+        self.assertIsNone(self.backend.get("c"))
+
+    def test_eviction(self):
+        for i in xrange(self.capacity + 1):
+            self.backend.set(str(i), "g", self.response("x"), 10)
+            self.backend.get("0")
+        self.assertIsNotNone(self.backend.get("0"))
+        missing = [i for i in xrange(self.capacity + 1)
+                if self.backend.get(str(i)) is None]
+        self.assertEqual(len(missing), 1)
+
+
+class MemoryBackendTests(BackendTests, unittest.TestCase):
+    capacity = 4
+
+    def setUp(self):
+        self.backend = pathfinder.cache.MemoryBackend(max_entries=4)
+
+    def test_max_bytes(self):
+        backend = pathfinder.cache.MemoryBackend(max_bytes=10)
+        backend.set("a", "g", self.response("x" * 6), 10)
+        backend.set("b", "g", self.response("x" * 6), 10)
+        backend.set("c", "g", self.response("x" * 11), 10)
+        self.assertIsNone(backend.get("a"))
+        self.assertIsNotNone(backend.get("b"))
+        self.assertIsNone(backend.get("c"))
+
+
+class SharedMemoryBackendTests(BackendTests, unittest.TestCase):
+    capacity = 4
+
+    def setUp(self):
+        self.backend = pathfinder.cache.SharedMemoryBackend(slots=4, ways=4)
+
+    def test_too_big(self):
+        backend = pathfinder.cache.SharedMemoryBackend(slot_size=256)
+        backend.set("a", "g", self.response("x" * 300), 10)
+        self.assertIsNone(backend.get("a"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# vim: fileencoding=utf8:et:sta:ai:sw=4:ts=4:sts=4
+
+import threading
+import time
+import unittest
+
+import pathfinder
+import pathfinder.coalesce
+from test_finder import fake_wsgi_request
+
+
+class CoalescingTests(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.gate = threading.Event()
+
+    def handler(self, request):
+        self.calls.append(request.path)
+        call = len(self.calls)
+        self.gate.wait()
+        return pathfinder.Response("result %d" % call,
+                headers=[('X-Call', str(call))])
+
+    def concurrently(self, finder, requests):
+        results = [None] * len(requests)
+        def run(i, path, headers):
+            results[i] = fake_wsgi_request(finder, "GET", path, headers)
+        threads = [threading.Thread(target=run, args=(i,) + request)
+                for i, request in enumerate(requests)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        self.gate.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_shares_one_call(self):
+        finder = pathfinder.Finder([
+            (r"^/\w+$", self.handler,
+                {'coalesce': pathfinder.coalesce.Coalescer()}),
+        ])
+        results = self.concurrently(finder, [("/foo", None)] * 10)
+        self.assertEqual(len(self.calls), 1)
+        for result in results:
+            self.assertEqual(result['code'], 200)
+            self.assertEqual(result['body'], "result 1")
+            self.assertIn(('X-Call', '1'), result['headers'])
+
+        self.gate.clear()
+        self.gate.set()
+        self.assertEqual(fake_wsgi_request(finder, "GET", "/foo")['body'],
+                "result 2")
+
+    def test_keys(self):
+        finder = pathfinder.Finder([
+            (r"^/\w+$", self.handler, {'coalesce':
+                pathfinder.coalesce.Coalescer(key_headers=['X-Tenant'])}),
+        ])
+        results = self.concurrently(finder, [
+            ("/foo", None), ("/foo", None), ("/bar", None),
+            ("/foo?a=1", None), ("/foo", {'X-Tenant': 'a'}),
+            ("/foo", {'x-tenant': 'a'})])
+        self.assertEqual(len(self.calls), 4)
+        bodies = [result['body'] for result in results]
+        self.assertEqual(bodies[0], bodies[1])
+        self.assertEqual(bodies[4], bodies[5])
+        self.assertEqual(len(set(bodies)), 4)
+
+    def test_personal_requests(self):
+        finder = pathfinder.Finder([
+            (r"^/\w+$", self.handler, {'coalesce':
+                pathfinder.coalesce.Coalescer(key_headers=['Cookie'])}),
+            (r"^/\w+/\w+$", self.handler,
+                {'coalesce': pathfinder.coalesce.Coalescer()}),
+        ])
+        results = self.concurrently(finder, [
+            ("/a/b", {'Cookie': 'u=alice'}), ("/a/b", {'Cookie': 'u=alice'}),
+            ("/a/b", {'Authorization': 'x'}), ("/a/b", {'Authorization': 'x'}),
+            ("/foo", {'Cookie': 'u=alice'}), ("/foo", {'Cookie': 'u=alice'}),
+            ("/foo", {'Cookie': 'u=bob'})])
+        self.assertEqual(len(self.calls), 6)
+        bodies = [result['body'] for result in results]
+        self.assertEqual(len(set(bodies[:4])), 4)
+        self.assertEqual(bodies[4], bodies[5])
+        self.assertNotEqual(bodies[4], bodies[6])
+
+    def test_unshareable(self):
+        def handler(request):
+            response = self.handler(request)
+            response.cookies['session'] = str(len(self.calls))
+            return response
+        finder = pathfinder.Finder([
+            (r"^/\w+$", handler,
+                {'coalesce': pathfinder.coalesce.Coalescer()}),
+        ])
+        results = self.concurrently(finder, [("/foo", None)] * 3)
+        self.assertEqual(len(self.calls), 3)
+        cookies = set(dict(result['headers'])['Set-Cookie']
+                for result in results)
+        self.assertEqual(len(cookies), 3)
+
+    def test_not_modified_unshared(self):
+        def validator(request):
+            self.gate.wait()
+            return '"v1"'
+        finder = pathfinder.Finder([
+            (r"^/\w+$", self.handler, {'etag': validator,
+                'coalesce': pathfinder.coalesce.Coalescer()}),
+        ])
+        results = [None, None]
+        def run(i, headers):
+            results[i] = fake_wsgi_request(finder, "GET", "/foo", headers)
+        leader = threading.Thread(target=run,
+                args=(0, {'If-None-Match': '"v1"'}))
+        follower = threading.Thread(target=run, args=(1, None))
+        leader.start()
+        time.sleep(0.05)
+        follower.start()
+        time.sleep(0.05)
+        self.gate.set()
+        leader.join()
+        follower.join()
+        self.assertEqual(results[0]['code'], 304)
+        self.assertEqual(results[1]['code'], 200)
+        self.assertEqual(results[1]['body'], "result 1")
+
+    def test_timeout(self):
+        coalescer = pathfinder.coalesce.Coalescer(timeout=0.01)
+        leader = threading.Thread(target=coalescer.call,
+                args=("key", lambda: self.gate.wait() or "slow"))
+        leader.start()
+        time.sleep(0.05)
+        self.assertEqual(coalescer.call("key", lambda: "fast"), "fast")
+        self.gate.set()
+        leader.join()
+        self.assertEqual(coalescer._flights, {})
+
+    def test_leader_raising(self):
+        coalescer = pathfinder.coalesce.Coalescer()
+        def fail():
+            raise RuntimeError("boom")
+        self.assertRaises(RuntimeError, coalescer.call, "key", fail)
+        self.assertEqual(coalescer._flights, {})
+        self.assertEqual(coalescer.call("key", lambda: 3), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
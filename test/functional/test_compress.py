@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# vim: fileencoding=utf8:et:sta:ai:sw=4:ts=4:sts=4
+
+import os
+import shutil
+import tempfile
+import unittest
+import zlib
+
+import pathfinder
+import pathfinder.compress
+import pathfinder.static
+from test_finder import fake_wsgi_request, fake_gevent_http_request
+
+
+def gunzip(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+class CompressorTests(object):
+    text = "".join("line %d of some compressible text\n" % i
+            for i in xrange(1000))
+
+    def setUp(self):
+        self.compressor = pathfinder.compress.Compressor()
+
+    def get(self, finder, path="/foo", accept="gzip, deflate"):
+        headers = {'Accept-Encoding': accept} if accept else {}
+        response = self.fake_request(finder, "GET", path, headers)
+        response['headers'] = dict(response['headers'])
+        return response
+
+    def finder(self, handler, **options):
+        return pathfinder.Finder([
+            (r"^/foo$", {"GET": handler}, options),
+        ], compression=self.compressor)
+
+    def test_compresses_strings(self):
+        finder = self.finder(lambda request: self.text)
+        response = self.get(finder)
+        self.assertEqual(response['code'], 200)
+        self.assertEqual(response['headers']['Content-Encoding'], 'gzip')
+        self.assertEqual(response['headers']['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['headers']['Content-Length'],
+                str(len(response['body'])))
+        self.assertEqual(gunzip(response['body']), self.text)
+
+    def test_encoding_negotiation(self):
+        finder = self.finder(lambda request: self.text)
+        response = self.get(finder, accept="gzip;q=0, deflate")
+        self.assertEqual(response['headers']['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(response['body']), self.text)
+
+        response = self.get(finder, accept="*")
+        self.assertEqual(response['headers']['Content-Encoding'], 'gzip')
+
+        for accept in (None, "identity", "br", "*;q=0"):
+            response = self.get(finder, accept=accept)
+            self.assertEqual(response['body'], self.text)
+            self.assertNotIn('Content-Encoding', response['headers'])
+            self.assertEqual(response['headers']['Vary'], 'Accept-Encoding')
+
+    def test_skipped_responses(self):
+        finder = pathfinder.Finder([
+            (r"^/small$", {"GET": lambda request: "tiny"}),
+            (r"^/png$", {"GET": lambda request: pathfinder.Response(
+                self.text, headers=[('Content-Type', 'image/png')])}),
+            (r"^/404$", {"GET": lambda request: pathfinder.Response(
+                self.text, code=404)}),
+            (r"^/off$", {"GET": lambda request: self.text},
+                {'compression': None}),
+        ], compression=self.compressor)
+
+        response = self.get(finder, "/small")
+        self.assertEqual(response['body'], "tiny")
+        self.assertEqual(response['headers']['Vary'], 'Accept-Encoding')
+
+        for path in ("/png", "/404", "/off"):
+            response = self.get(finder, path)
+            self.assertEqual(response['body'], self.text)
+            self.assertNotIn('Content-Encoding', response['headers'])
+            self.assertNotIn('Vary', response['headers'])
+
+    def test_compresses_iterables(self):
+        def handler(request):
+            return pathfinder.Response(
+                    (line + "\n" for line in self.text.splitlines()),
+                    headers=[('Content-Type', 'application/json')])
+        response = self.get(self.finder(handler))
+        self.assertEqual(response['headers']['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', response['headers'])
+        self.assertEqual(gunzip(response['body']), self.text)
+
+    def test_closes_iterables(self):
+        closed = []
+        class Body(object):
+            def __iter__(self):
+                return iter(["{}"] * 200)
+            def close(self):
+                closed.append(1)
+        response = self.get(self.finder(lambda request: pathfinder.Response(
+            Body(), headers=[('Content-Type', 'application/json')])))
+        self.assertEqual(gunzip(response['body']), "{}" * 200)
+        self.assertEqual(closed, [1])
+
+    def test_static_response_variants(self):
+        static = pathfinder.StaticResponse(self.text)
+        finder = self.finder(static)
+        first = self.get(finder)
+        self.assertEqual(gunzip(first['body']), self.text)
+        self.assertEqual(len(self.compressor._cache), 1)
+        variant, = [v for v, size in self.compressor._cache.values()]
+        self.assertEqual(self.get(finder)['body'], variant.content)
+
+        response = self.get(finder, accept=None)
+        self.assertEqual(response['body'], self.text)
+        self.assertEqual(response['headers']['Vary'], 'Accept-Encoding')
+        self.assertEqual(len(self.compressor._cache), 2)
+
+    def test_etag_variants(self):
+        calls = []
+        def handler(request):
+            calls.append(1)
+            return pathfinder.Response(self.text, headers=[('ETag', '"v1"')])
+        finder = self.finder(handler)
+        first = self.get(finder)
+        self.assertEqual(first['headers']['ETag'], 'W/"v1"')
+        self.assertEqual(len(self.compressor._cache), 1)
+        second = self.get(finder)
+        self.assertEqual(second['body'], first['body'])
+        self.assertEqual(len(calls), 2)
+
+    def test_etag_variants_per_uri(self):
+        def handler(request):
+            return pathfinder.Response("%s %s %s" % (request.query_string,
+                request.headers.get('x-lang', ''), self.text),
+                headers=[('Vary', 'X-Lang')])
+        finder = pathfinder.Finder([
+            (r"^/items$", {"GET": handler}, {'etag': lambda request: '"v3"'}),
+        ], compression=self.compressor)
+        for path, lang in [("/items", "en"), ("/items?page=2", "en"),
+                ("/items?page=2", "de")]:
+            for i in xrange(2):
+                response = self.fake_request(finder, "GET", path,
+                        {'Accept-Encoding': 'gzip', 'X-Lang': lang})
+                query = path.partition("?")[2]
+                self.assertEqual(gunzip(response['body']),
+                        "%s %s %s" % (query, lang, self.text))
+        self.assertEqual(len(self.compressor._cache), 3)
+
+    def test_private_responses_not_kept(self):
+        def handler(request):
+            return pathfinder.Response(
+                    "%s %s" % (request.cookies['u'].value, self.text),
+                    headers=[('ETag', '"v1"'),
+                        ('Cache-Control', 'private')])
+        finder = self.finder(handler)
+        for user in ("alice", "bob"):
+            response = self.fake_request(finder, "GET", "/foo", {
+                'Accept-Encoding': 'gzip', 'Cookie': 'u=' + user})
+            self.assertEqual(gunzip(response['body']),
+                    "%s %s" % (user, self.text))
+        self.assertEqual(len(self.compressor._cache), 0)
+
+    def test_not_modified_headers(self):
+        finder = pathfinder.Finder([
+            (r"^/foo$", {"GET": lambda request: self.text}),
+            (r"^/small$", {"GET": lambda request: "tiny"}),
+        ], compression=self.compressor, conditional=True)
+        for path in ("/foo", "/small"):
+            first = self.get(finder, path)
+            response = self.fake_request(finder, "GET", path, {
+                'Accept-Encoding': 'gzip',
+                'If-None-Match': first['headers']['ETag']})
+            self.assertEqual(response['code'], 304)
+            headers = dict(response['headers'])
+            self.assertEqual(headers['ETag'], first['headers']['ETag'])
+            self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertTrue(first['headers']['ETag'].startswith('"'))
+
+    def test_head(self):
+        iterated = []
+        def chunks():
+            iterated.append(1)
+            yield self.text
+        finder = pathfinder.Finder([
+            (r"^/static$", pathfinder.StaticResponse(self.text)),
+            (r"^/etag$", {"GET": lambda request: pathfinder.Response(
+                self.text, headers=[('ETag', '"v1"')])}),
+            (r"^/gen$", {"GET": lambda request: pathfinder.Response(
+                chunks(), headers=[('Content-Type', 'text/plain')])}),
+        ], compression=self.compressor)
+        headers = {'Accept-Encoding': 'gzip'}
+        for path in ("/static", "/etag"):
+            # HEAD before and after the GET which caches the variant
+            for method in ("HEAD", "GET", "HEAD"):
+                response = self.fake_request(finder, method, path, headers)
+                if method == "GET":
+                    get = response
+                    continue
+                self.assertEqual(response['body'], "")
+                head = dict(response['headers'])
+                self.assertEqual(head['Content-Encoding'], 'gzip')
+                self.assertTrue(head['ETag'].startswith('W/'))
+                self.assertEqual(head['Vary'], 'Accept-Encoding')
+            self.assertEqual(head['Content-Length'],
+                    str(len(get['body'])))
+
+        response = self.fake_request(finder, "HEAD", "/gen", headers)
+        self.assertEqual(response['body'], "")
+        self.assertEqual(dict(response['headers'])['Content-Encoding'],
+                'gzip')
+        self.assertNotIn('Content-Length', dict(response['headers']))
+        self.assertEqual(iterated, [])
+
+    def test_cache_bounds(self):
+        compressor = pathfinder.compress.Compressor(max_entries=2)
+        for i in xrange(3):
+            compressor._put(i, str(i), 1)
+        self.assertEqual(compressor._cache.keys(), [1, 2])
+        compressor._put(3, "x" * 10, 2**25)
+        self.assertEqual(compressor._cache.keys(), [1, 2])
+
+    def test_static_files(self):
+        root = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(root, "a.txt"), 'wb') as f:
+                f.write(self.text)
+            finder = pathfinder.Finder([
+                (r"^/static/(.*)$", pathfinder.static.StaticFiles(root)),
+                # where a.txt counts as a large file, sent from disk
+                (r"^/large/(.*)$", pathfinder.static.StaticFiles(root,
+                    small_size=100)),
+            ], compression=self.compressor)
+            for path in ("/static/a.txt", "/large/a.txt"):
+                response = self.get(finder, path)
+                self.assertEqual(gunzip(response['body']), self.text)
+                etag = response['headers']['ETag']
+                self.assertTrue(etag.startswith('W/'))
+
+                response = self.fake_request(finder, "GET", path,
+                        {'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+                self.assertEqual(response['code'], 304)
+                headers = dict(response['headers'])
+                self.assertEqual(headers['ETag'], etag)
+                self.assertEqual(headers['Vary'], 'Accept-Encoding')
+                self.assertNotIn('Content-Type', headers)
+                self.assertNotIn('Accept-Ranges', headers)
+        finally:
+            shutil.rmtree(root)
+
+
+class CompressorOnGeventHTTPTests(CompressorTests, unittest.TestCase):
+    fake_request = staticmethod(fake_gevent_http_request)
+
+
+class CompressorOnWSGITests(CompressorTests, unittest.TestCase):
+    fake_request = staticmethod(fake_wsgi_request)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,9 @@
 # vim: fileencoding=utf8:et:sta:ai:sw=4:ts=4:sts=4
 
 import Cookie
+import hashlib
 import sys
+import tempfile
 import unittest
 import urllib
 try:
@@ -85,6 +87,15 @@ class FakeGeventHTTPRequest(object):
             'body': body,
         }
 
+    def send_reply_start(self, code, status_text):
+        self.send_reply(code, status_text, "")
+
+    def send_reply_chunk(self, data):
+        self._response['body'] += data
+
+    def send_reply_end(self):
+        pass
+
 
 class FinderTests(object):
     def assertResponseCode(self, code,
@@ -140,6 +151,20 @@ class FinderTests(object):
                 body=req_body)
         self.assertEqual(d, {'a': '1', 'b': '2'})
 
+    def test_params_combined(self):
+        m = []
+        def handler(request):
+            m.append(request.params.items())
+            m.append(request.params is request.params)
+            return "OK!"
+        finder = pathfinder.Finder([
+            (r"^/foo$", {"POST": handler}),
+        ])
+        self.assertResponseCode(200, finder, "POST", "/foo?a=1&b=2",
+                headers={'content-type': 'application/x-www-form-urlencoded'},
+                body="a=3")
+        self.assertEqual(m, [[('a', '1'), ('b', '2'), ('a', '3')], True])
+
     def test_no_body_params_on_GET(self):
         d = {}
         def handler(request):
@@ -232,6 +257,329 @@ class FinderTests(object):
         self.assertResponseCode(200, finder, "GET", "/foo", headers=ch)
         self.assertEqual(m[0], c)
 
+    def test_static_response(self):
+        class Static(pathfinder.StaticResponse):
+            def finalize(self, request):
+                raise AssertionError("finalized a StaticResponse")
+        hello = Static("hello", headers=[('X-Thing', '1')])
+        finder = pathfinder.Finder([
+            (r"^/handler$", {"GET": lambda request: hello}),
+            (r"^/route$", hello),
+        ])
+        for path in ("/handler", "/route"):
+            response = self.fake_request(finder, "GET", path)
+            self.assertEqual(response['code'], 200)
+            self.assertEqual(response['status'], "OK")
+            self.assertEqual(response['body'], "hello")
+            self.assertEqual(list(response['headers']), [
+                ('X-Thing', '1'),
+                ('Content-Length', '5'),
+                ('Content-Type', 'text/html'),
+                ('ETag', '"%s"' % hashlib.md5("hello").hexdigest())])
+        self.assertEqual(hello.status, "200 OK")
+        self.assertEqual(hello.headers['content-length'], '5')
+
+        def replace_headers():
+            hello.headers = [('X-Thing', '2')]
+        def set_cookie():
+            hello.cookies['a'] = 'b'
+        self.assertRaises(AttributeError, replace_headers)
+        self.assertRaises(TypeError, set_cookie)
+        self.assertEqual(len(hello.cookies), 0)
+        self.assertEqual(hello.headers['x-thing'], '1')
+
+    def test_response_headers(self):
+        seen = []
+        def handler(request):
+            response = pathfinder.Response("OK!", headers=[('X-One', '1')])
+            response.add_header('X-Two', '2')
+            seen.append(response._headers)
+            return response
+        def promoting_handler(request):
+            response = pathfinder.Response("OK!", headers={'X-One': '1'})
+            response.headers['X-Two'] = '2'
+            response.add_header('x-one', '3')
+            seen.append(response.headers.getall('X-ONE'))
+            return response
+        finder = pathfinder.Finder([
+            (r"^/list$", {"GET": handler}),
+            (r"^/dict$", {"GET": promoting_handler}),
+        ])
+        response = self.fake_request(finder, "GET", "/list")
+        self.assertEqual(list(response['headers']), [
+            ('X-One', '1'), ('X-Two', '2'), ('Content-Type', 'text/html')])
+        self.assertIsNone(seen.pop())
+
+        response = self.fake_request(finder, "GET", "/dict")
+        self.assertEqual(list(response['headers']), [
+            ('X-One', '1'), ('X-Two', '2'), ('x-one', '3'),
+            ('Content-Type', 'text/html')])
+        self.assertEqual(seen.pop(), ['1', '3'])
+
+    def test_conditional(self):
+        finder = pathfinder.Finder([
+            (r"^/str$", {"GET": lambda request: "hello"}),
+            (r"^/tagged$", {"GET": lambda request: pathfinder.Response(
+                "hello", headers=[('ETag', 'W/"v1"'),
+                    ('Cache-Control', 'max-age=60')])}),
+            (r"^/static$", pathfinder.StaticResponse("hello")),
+            (r"^/off$", {"GET": lambda request: "hello"},
+                {'conditional': False}),
+        ], conditional=True)
+        etag = '"%s"' % hashlib.md5("hello").hexdigest()
+
+        for path in ("/str", "/static"):
+            response = self.fake_request(finder, "GET", path)
+            self.assertEqual(response['code'], 200)
+            self.assertIn(('ETag', etag), response['headers'])
+
+            response = self.fake_request(finder, "GET", path,
+                    {'If-None-Match': '"other", W/%s' % etag})
+            self.assertEqual(response['code'], 304)
+            self.assertEqual(response['body'], "")
+            self.assertEqual(list(response['headers']), [('ETag', etag)])
+
+        response = self.fake_request(finder, "GET", "/tagged",
+                {'If-None-Match': '"v1"'})
+        self.assertEqual(response['code'], 304)
+        self.assertEqual(list(response['headers']), [
+            ('ETag', 'W/"v1"'), ('Cache-Control', 'max-age=60')])
+
+        response = self.fake_request(finder, "GET", "/str",
+                {'If-None-Match': '"other"'})
+        self.assertEqual(response['code'], 200)
+
+        response = self.fake_request(finder, "GET", "/off",
+                {'If-None-Match': etag})
+        self.assertEqual(response['code'], 200)
+        self.assertNotIn('ETag', dict(response['headers']))
+
+    def test_etag_validator(self):
+        calls = []
+        def validator(request, name):
+            return '"%s-v2"' % name
+        def handler(request, name):
+            calls.append(name)
+            return "hello " + name
+        finder = pathfinder.Finder([
+            (r"^/(\w+)$", {"GET": handler}, {'etag': validator}),
+        ])
+        response = self.fake_request(finder, "GET", "/foo")
+        self.assertEqual(response['code'], 200)
+        self.assertIn(('ETag', '"foo-v2"'), response['headers'])
+        self.assertEqual(calls, ["foo"])
+
+        response = self.fake_request(finder, "GET", "/foo",
+                {'If-None-Match': '"foo-v2"'})
+        self.assertEqual(response['code'], 304)
+        self.assertEqual(list(response['headers']), [('ETag', '"foo-v2"')])
+        self.assertEqual(calls, ["foo"])
+
+        response = self.fake_request(finder, "GET", "/foo",
+                {'If-None-Match': '"foo-v1"'})
+        self.assertEqual(response['code'], 200)
+        self.assertEqual(calls, ["foo", "foo"])
+
+    def test_file_response(self):
+        body = "".join(chr(i % 256) for i in xrange(200000))
+        f = tempfile.NamedTemporaryFile()
+        f.write(body)
+        f.flush()
+        finder = pathfinder.Finder([
+            (r"^/path$", {"GET": lambda request:
+                pathfinder.FileResponse(f.name)}),
+            (r"^/file$", {"GET": lambda request:
+                pathfinder.FileResponse(StringIO(body),
+                    headers=[('Content-Type', 'text/plain')])}),
+        ])
+        response = self.fake_request(finder, "GET", "/path")
+        self.assertEqual(response['code'], 200)
+        self.assertEqual(response['body'], body)
+        self.assertEqual(dict(response['headers']), {
+            'Content-Length': str(len(body)),
+            'Content-Type': 'application/octet-stream'})
+
+        response = self.fake_request(finder, "GET", "/file")
+        self.assertEqual(response['body'], body)
+        self.assertEqual(dict(response['headers']), {
+            'Content-Type': 'text/plain'})
+
+        response = pathfinder.FileResponse(f.name, length=5)
+        self.assertEqual(response.get_header('content-length'), '5')
+        self.assertEqual("".join(response.content), body[:5])
+
+    def test_head(self):
+        iterated = []
+        def chunks():
+            iterated.append(1)
+            yield "never sent"
+        files = []
+        def file_handler(request):
+            files.append(StringIO("contents"))
+            return pathfinder.FileResponse(files[-1])
+        static = pathfinder.StaticResponse("static body")
+        finder = pathfinder.Finder([
+            (r"^/string$", {"GET": lambda request: "a body"}),
+            (r"^/list$", {"GET": lambda request:
+                pathfinder.Response(["ab", "cde"])}),
+            (r"^/gen$", {"GET": lambda request:
+                pathfinder.Response(chunks())}),
+            (r"^/file$", {"GET": file_handler}),
+            (r"^/static$", static),
+            (r"^/cheap$", {
+                "GET": lambda request: "expensive",
+                "HEAD": lambda request: pathfinder.Response("",
+                    headers=[('Content-Length', '9')])}),
+            (r"^/posted$", {"POST": lambda request: "posted"}),
+        ])
+
+        for path, length in [("/string", "6"), ("/list", "5"),
+                ("/static", "11"), ("/cheap", "9")]:
+            response = self.fake_request(finder, "HEAD", path)
+            self.assertEqual(response['code'], 200)
+            self.assertEqual(response['body'], "")
+            self.assertEqual(dict(response['headers'])['Content-Length'],
+                    length)
+
+        response = self.fake_request(finder, "HEAD", "/gen")
+        self.assertEqual(response['body'], "")
+        self.assertNotIn('Content-Length', dict(response['headers']))
+        self.assertEqual(iterated, [])
+
+        response = self.fake_request(finder, "HEAD", "/file")
+        self.assertEqual(response['body'], "")
+        self.assertTrue(files[0].closed)
+        self.assertIs(static.head(), static.head())
+        self.assertResponseCode(404, finder, "HEAD", "/posted")
+
+    def test_iterable_bodies(self):
+        chunks = ["x" * i for i in xrange(20)]
+        closed = []
+        def generate():
+            try:
+                for chunk in chunks:
+                    yield chunk
+            finally:
+                closed.append(1)
+        finder = pathfinder.Finder([
+            (r"^/list$", {"GET": lambda request:
+                pathfinder.Response(chunks)}),
+            (r"^/tuple$", {"GET": lambda request:
+                pathfinder.Response(tuple(chunks))}),
+            (r"^/gen$", {"GET": lambda request:
+                pathfinder.Response(generate())}),
+            (r"^/stream$", {"GET": lambda request:
+                pathfinder.Response(generate())}, {'buffer_size': None}),
+        ], buffer_size=50)
+        body = "".join(chunks)
+
+        for path in ("/list", "/tuple"):
+            response = self.fake_request(finder, "GET", path)
+            self.assertEqual(response['body'], body)
+            self.assertEqual(dict(response['headers'])['Content-Length'],
+                    str(len(body)))
+
+        response = self.fake_request(finder, "GET", "/gen")
+        self.assertEqual(response['body'], body)
+        self.assertNotIn('Content-Length', dict(response['headers']))
+        self.assertEqual(closed, [1])
+
+        buffered = list(pathfinder._coalesced(generate(), 50))
+        self.assertEqual("".join(buffered), body)
+        self.assertTrue(all(len(chunk) >= 50 for chunk in buffered[:-1]))
+        self.assertEqual(len(buffered), 4)
+        self.assertEqual(closed, [1, 1])
+
+        response = self.fake_request(finder, "GET", "/stream")
+        self.assertEqual(response['body'], body)
+
+    def multipart_request(self, handler, fields, code=200, finder=None):
+        body = "".join(
+            "--xyz\r\nContent-Disposition: form-data; name=\"%s\"\r\n\r\n"
+            "%s\r\n" % field for field in fields) + "--xyz--\r\n"
+        finder = finder or pathfinder.Finder([
+            (r"^/foo$", {"POST": handler}),
+        ])
+        self.assertResponseCode(code, finder, "POST", "/foo", headers={
+                'content-type': 'multipart/form-data; boundary=xyz',
+                'content-length': str(len(body))}, body=body)
+
+    def test_multipart_parts(self):
+        m = []
+        def handler(request):
+            m.extend((part.name, part.size, part.body)
+                    for part in request.parts)
+            return "OK!"
+        self.multipart_request(handler, [("a", "1"), ("b", "\r\n22")])
+        self.assertEqual(m, [("a", 1, u"1"), ("b", 4, u"\r\n22")])
+
+    def test_multipart_part_tuple(self):
+        m = []
+        def handler(request):
+            for part in request.parts:
+                headers, size, name, filename, charset, ctopts, cdopts, \
+                        body = part
+                m.append((body, part[7], part._asdict()['body'],
+                    unicode(body), body + u"!"))
+            return "OK!"
+        self.multipart_request(handler, [("a", "1")])
+        self.assertEqual(m, [(u"1", u"1", u"1", u"1", u"1!")])
+
+    def test_multipart_sinks(self):
+        sunk, m = [], []
+        def handler(request):
+            request.add_part_sink("b", sunk.append)
+            m.extend((part.name, part.body) for part in request.parts)
+            return "OK!"
+        self.multipart_request(handler, [("a", "1"), ("b", "22")])
+        self.assertEqual(m, [("a", u"1"), ("b", None)])
+        self.assertEqual("".join(sunk), "22")
+
+    def test_multipart_digests(self):
+        m = []
+        def handler(request):
+            request.part_digests.extend(['md5', 'sha256'])
+            request.add_part_sink("b", lambda data: None)
+            m.extend(part.digests for part in request.parts)
+            return "OK!"
+        self.multipart_request(handler, [("a", "1"), ("b", "22")])
+        self.assertEqual(m, [
+            {'md5': hashlib.md5("1").hexdigest(),
+                'sha256': hashlib.sha256("1").hexdigest()},
+            {'md5': hashlib.md5("22").hexdigest(),
+                'sha256': hashlib.sha256("22").hexdigest()}])
+
+    def handler_read_parts(self, request):
+        for part in request.parts:
+            pass
+        return "OK!"
+
+    def test_multipart_finder_limits(self):
+        finder = pathfinder.Finder([
+            (r"^/foo$", {"POST": self.handler_read_parts}),
+        ], multipart_limits={'mem_limit': 100})
+        self.multipart_request(None, [("a", "x" * 200)], 413, finder)
+        self.multipart_request(None, [("a", "x" * 50)], 200, finder)
+
+    def test_multipart_route_limits(self):
+        finder = pathfinder.Finder([
+            (r"^/foo$", {"POST": self.handler_read_parts},
+                {'multipart_limits': {'mem_limit': 1000}}),
+        ], multipart_limits={'mem_limit': 100})
+        self.multipart_request(None, [("a", "x" * 200)], 200, finder)
+
+    def test_multipart_budget(self):
+        budget = pathfinder.multipart.MemoryBudget(30)
+        finder = pathfinder.Finder([
+            (r"^/foo$", {"POST": self.handler_read_parts}),
+        ], multipart_limits={'budget': budget})
+        self.multipart_request(None, [("a", "x" * 20)], 200, finder)
+        self.assertEqual(budget.used, 0)
+        budget.acquire(20)
+        self.multipart_request(None, [("a", "x" * 20)], 413, finder)
+        budget.release(20)
+        self.assertEqual(budget.used, 0)
+
     def test_body_read(self):
         body = "this is a test"
         m = []
@@ -257,6 +605,29 @@ class FinderOnGeventHTTPTests(FinderTests, unittest.TestCase):
 class FinderOnWSGITests(FinderTests, unittest.TestCase):
     fake_request = staticmethod(fake_wsgi_request)
 
+    def test_file_wrapper(self):
+        f = tempfile.TemporaryFile()
+        f.write("some file contents")
+        f.seek(5)
+        wrapped = []
+        def file_wrapper(filelike, blocksize):
+            wrapped.append((filelike, blocksize))
+            return iter(lambda: filelike.read(blocksize), "")
+        finder = pathfinder.Finder([
+            (r"^/foo$", lambda request: pathfinder.FileResponse(f)),
+        ])
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "PATH_INFO": "/foo",
+            "wsgi.input": StringIO(""),
+            "wsgi.file_wrapper": file_wrapper,
+        }
+        headers = []
+        result = finder.wsgi(environ, lambda s, h: headers.extend(h))
+        self.assertEqual("".join(result), "file contents")
+        self.assertEqual(wrapped, [(f, pathfinder.FileResponse.BLOCKSIZE)])
+        self.assertIn(('Content-Length', '13'), headers)
+
 
 class SubFinderTests(object):
     def assertResponseCode(self, code,
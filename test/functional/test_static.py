@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# vim: fileencoding=utf8:et:sta:ai:sw=4:ts=4:sts=4
+
+import email.utils
+import os
+import shutil
+import tempfile
+import time
+import unittest
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+import pathfinder
+import pathfinder.static
+from test_finder import fake_wsgi_request, fake_gevent_http_request
+
+
+class StaticFilesTests(object):
+    small = "small file\n"
+    large = "".join(chr(i % 251) for i in xrange(300000))
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.write("small.txt", self.small)
+        self.write("large.bin", self.large)
+        os.mkdir(os.path.join(self.root, "dir"))
+        self.static = pathfinder.static.StaticFiles(self.root)
+        self.finder = pathfinder.Finder([
+            (r"^/static/(?P<path>.*)$", self.static),
+        ])
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, data, mtime=None):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def get(self, path, headers=None, method="GET"):
+        response = self.fake_request(self.finder, method, path, headers)
+        response['headers'] = dict(response['headers'])
+        return response
+
+    def test_serves_files(self):
+        response = self.get("/static/small.txt")
+        self.assertEqual(response['code'], 200)
+        self.assertEqual(response['body'], self.small)
+        self.assertEqual(response['headers']['Content-Type'], 'text/plain')
+        self.assertEqual(response['headers']['Content-Length'],
+                str(len(self.small)))
+
+        response = self.get("/static/large.bin")
+        self.assertEqual(response['code'], 200)
+        self.assertEqual(response['body'], self.large)
+        self.assertEqual(response['headers']['Content-Length'],
+                str(len(self.large)))
+
+    def test_not_found(self):
+        self.assertEqual(self.get("/static/missing")['code'], 404)
+        self.assertEqual(self.get("/static/dir")['code'], 404)
+        self.assertEqual(self.get("/static/")['code'], 404)
+        self.assertEqual(self.get("/static/../etc/passwd")['code'], 404)
+        self.assertEqual(self.get("/static/dir/../../x")['code'], 404)
+
+    def test_method_not_allowed(self):
+        response = self.get("/static/small.txt", method="POST")
+        self.assertEqual(response['code'], 405)
+        self.assertEqual(response['headers']['Allow'], 'GET, HEAD')
+
+    def test_head(self):
+        response = self.get("/static/large.bin", method="HEAD")
+        self.assertEqual(response['code'], 200)
+        self.assertEqual(response['body'], "")
+        self.assertEqual(response['headers']['Content-Length'],
+                str(len(self.large)))
+
+    def test_cache_invalidated_by_mtime(self):
+        self.write("small.txt", self.small, time.time() - 100)
+        first = self.get("/static/small.txt")
+        self.assertEqual(self.get("/static/small.txt")['headers']['ETag'],
+                first['headers']['ETag'])
+
+        self.write("small.txt", "changed\n")
+        second = self.get("/static/small.txt")
+        self.assertEqual(second['body'], "changed\n")
+        self.assertNotEqual(second['headers']['ETag'],
+                first['headers']['ETag'])
+
+    def test_cache_bounds(self):
+        static = pathfinder.static.StaticFiles(self.root, max_entries=3,
+                max_bytes=25)
+        for i in xrange(5):
+            self.write("%d.txt" % i, "0123456789")
+            static.lookup("%d.txt" % i)
+        self.assertEqual(len(static._cache), 2)
+        self.assertEqual(static._cached_bytes, 20)
+
+        static.lookup("large.bin")
+        static.lookup("4.txt")
+        self.assertEqual([os.path.basename(p) for p in static._cache],
+                ["3.txt", "large.bin", "4.txt"])
+
+    def test_if_none_match(self):
+        etag = self.get("/static/small.txt")['headers']['ETag']
+        response = self.get("/static/small.txt",
+                {'If-None-Match': '"nope", %s' % etag})
+        self.assertEqual(response['code'], 304)
+        self.assertEqual(response['body'], "")
+        self.assertEqual(response['headers']['ETag'], etag)
+
+        response = self.get("/static/small.txt", {'If-None-Match': '"nope"'})
+        self.assertEqual(response['code'], 200)
+
+    def test_if_modified_since(self):
+        mtime = time.time() - 100
+        self.write("small.txt", self.small, mtime)
+        response = self.get("/static/small.txt", {
+            'If-Modified-Since': email.utils.formatdate(mtime, usegmt=True)})
+        self.assertEqual(response['code'], 304)
+
+        response = self.get("/static/small.txt", {
+            'If-Modified-Since':
+                email.utils.formatdate(mtime - 10, usegmt=True)})
+        self.assertEqual(response['code'], 200)
+
+    def test_ranges(self):
+        for path, body in (("/static/small.txt", self.small),
+                ("/static/large.bin", self.large)):
+            size = len(body)
+            for rng, start, end in (("0-4", 0, 5), ("3-", 3, size),
+                    ("-4", size - 4, size), ("2-100000000", 2, size)):
+                response = self.get(path, {'Range': 'bytes=' + rng})
+                self.assertEqual(response['code'], 206)
+                self.assertEqual(response['body'], body[start:end])
+                self.assertEqual(response['headers']['Content-Range'],
+                        'bytes %d-%d/%d' % (start, end - 1, size))
+                self.assertEqual(response['headers']['Content-Length'],
+                        str(end - start))
+
+            response = self.get(path, {'Range': 'bytes=%d-' % size})
+            self.assertEqual(response['code'], 416)
+            self.assertEqual(response['headers']['Content-Range'],
+                    'bytes */%d' % size)
+
+            for rng in ("bytes=5-2", "bytes=0-1,4-5", "lines=1-2"):
+                response = self.get(path, {'Range': rng})
+                self.assertEqual(response['code'], 200)
+                self.assertEqual(response['body'], body)
+
+    def test_if_range(self):
+        headers = self.get("/static/large.bin")['headers']
+        for validator, code in ((headers['ETag'], 206),
+                (headers['Last-Modified'], 206), ('"stale"', 200)):
+            response = self.get("/static/large.bin", {
+                'Range': 'bytes=0-9', 'If-Range': validator})
+            self.assertEqual(response['code'], code)
+
+
+class StaticFilesOnGeventHTTPTests(StaticFilesTests, unittest.TestCase):
+    fake_request = staticmethod(fake_gevent_http_request)
+
+
+class StaticFilesOnWSGITests(StaticFilesTests, unittest.TestCase):
+    fake_request = staticmethod(fake_wsgi_request)
+
+    def wsgi(self, path, headers=(), **environ):
+        environ.update({"REQUEST_METHOD": "GET", "PATH_INFO": path,
+            "wsgi.input": StringIO("")})
+        for key, value in headers:
+            environ["HTTP_" + key.replace("-", "_").upper()] = value
+        return self.finder.wsgi(environ, lambda status, headers: None)
+
+    def test_file_wrapper(self):
+        wrapped = []
+        def file_wrapper(f, blocksize):
+            wrapped.append(f)
+            return iter(lambda: f.read(blocksize), "")
+        body = self.wsgi("/static/large.bin", **{
+            'wsgi.file_wrapper': file_wrapper})
+        self.assertEqual("".join(body), self.large)
+        self.assertEqual(len(wrapped), 1)
+
+        # ranges are read up to their end, so not given to the server
+        body = self.wsgi("/static/large.bin", [('Range', 'bytes=0-9')], **{
+            'wsgi.file_wrapper': file_wrapper})
+        self.assertEqual("".join(body), self.large[:10])
+        self.assertEqual(len(wrapped), 1)
+
+    def test_truncated_while_sending(self):
+        body = iter(self.wsgi("/static/large.bin"))
+        first = next(body)
+        with open(os.path.join(self.root, "large.bin"), 'r+b') as f:
+            f.truncate(len(first) + 10)
+        self.assertEqual(first + "".join(body),
+                self.large[:len(first) + 10])
+
+
+if __name__ == '__main__':
+    unittest.main()
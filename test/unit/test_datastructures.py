@@ -308,6 +308,27 @@ class OMDSpecialBehavior(object):
         self.assertEqual(d['a'], 10)
         self.assertEqual(d.items(), [('b', 2), ('c', 3), ('b', 5), ('a', 10)])
 
+    def test_copy_on_write(self):
+        d = self.omd([('a', 1), ('b', 2), ('A', 3)])
+        c = d.copy()
+        c['c'] = 4
+        del c['b']
+        c.popall('a')
+        self.assertEqual(d.items(), [('a', 1), ('b', 2), ('A', 3)])
+        d.replace('b', 5)
+        d.pop('a')
+        self.assertEqual(d.copy().items(), d.items())
+        self.assertNotEqual(c.items(), d.items())
+
+    def test_fromitems(self):
+        pairs = [('a', 1), ('b', 2), ('c', 3), ('a', 4), ('b', 5)]
+        d = type(self.omd()).fromitems(iter(pairs))
+        self.assertIs(type(d), type(self.omd()))
+        self.assertEqual(d.items(), pairs)
+        self.assertEqual(d.getall('a'), [1, 4])
+        self.assertEqual(d['b'], 5)
+        self.assertEqual(len(type(self.omd()).fromitems([])), 0)
+
 
 class OMDSpecialBehaviorTests(OMDSpecialBehavior, unittest.TestCase):
     #
@@ -405,22 +426,20 @@ class OMDInternals(object):
     # use an assertion that the whole internal data structure is sound
     #
     def assertHealthy(self, d):
-        nodes = []
-        node = d._head
-        prevnode = None
-        while node:
-            nodes.append(node)
-            nextnode = node.next
-            if nextnode:
-                self.assertIs(nextnode.prev, node)
-            prevnode, node = node, nextnode
-        self.assertIs(d._tail, prevnode)
-        self.assertEqual(d._len, len(nodes))
-        x = {}
-        for n in nodes:
-            x.setdefault(n.key, []).append(n)
-        self.assertEqual(d._dict, x)
-        return nodes
+        self.assertEqual(len(d._keys), len(d._values))
+        if d._keys:
+            self.assertIsNot(d._keys[-1], pathfinder.util._deleted)
+        live, index = [], {}
+        for i, (key, value) in enumerate(zip(d._keys, d._values)):
+            if key is pathfinder.util._deleted:
+                self.assertIs(value, None)
+                continue
+            live.append((key, value))
+            index.setdefault(key, []).append(i)
+        self.assertEqual(d._len, len(live))
+        self.assertEqual(d._dead, len(d._keys) - len(live))
+        self.assertEqual(d._index, index)
+        return live
 
     #
     # tests that ensure the internal state of an OMD remains good
@@ -455,6 +474,17 @@ class OMDInternals(object):
         self.assertHealthy(d.copy())
         self.assertHealthy(d)
 
+    def test_copy_then_mutate(self):
+        d = self.omd([('a', 1), ('b', 2), ('A', 3), ('c', 4)])
+        c = d.copy()
+        c['d'] = 5
+        self.assertHealthy(c)
+        self.assertHealthy(d)
+        del d['a']
+        d.replace('C', 6)
+        self.assertHealthy(c)
+        self.assertHealthy(d)
+
     def test_pop(self):
         d = self.omd({'a': 1, 'b': 2, 'c': 3})
         d.pop('b')
@@ -477,6 +507,13 @@ class OMDInternals(object):
         d.update({'a': 5, 'B': 6})
         self.assertHealthy(d)
 
+    def test_fromitems(self):
+        d = type(self.omd()).fromitems(
+                [('a', 1), ('b', 2), ('A', 3), ('a', 4), ('c', 5)])
+        self.assertHealthy(d)
+        d.update([('B', 6), ('c', 7)], c=8)
+        self.assertHealthy(d)
+
     def test_popall(self):
         d = self.omd([('a', 1), ('b', 2), ('c', 3), ('a', 4)])
         d.popall('a')
@@ -494,6 +531,24 @@ class OMDInternals(object):
         d.replace('a', 12)
         self.assertHealthy(d)
 
+    def test_compaction(self):
+        d = self.omd(('k%d' % i, i) for i in xrange(100))
+        for i in xrange(0, 90):
+            del d['k%d' % i]
+            self.assertHealthy(d)
+        self.assertTrue(len(d._keys) < 50)
+        self.assertEqual(d.items(), [('k%d' % i, i) for i in xrange(90, 100)])
+
+    def test_iteration_survives_compaction(self):
+        d = self.omd(('k%d' % i, i) for i in xrange(100))
+        seen = []
+        for key, value in d.iteritems():
+            seen.append(value)
+            if value < 50:
+                del d['k%d' % (99 - value)]
+        self.assertEqual(seen, range(50))
+        self.assertHealthy(d)
+
 
 class OMDInternalDataStructuresTests(OMDInternals, unittest.TestCase):
     #
@@ -509,18 +564,132 @@ class CIOMDInternalDataStructuresTests(OMDInternals, unittest.TestCase):
     # adding in checks against the case-insensitive data structure
     #
     def assertHealthy(self, d):
-        nodes = super(CIOMDInternalDataStructuresTests, self).assertHealthy(d)
+        live = super(CIOMDInternalDataStructuresTests, self).assertHealthy(d)
         x = {}
-        for n in nodes:
-            lst, st = x.setdefault(n.key.lower(), ([], set()))
-            if n.key not in st:
-                lst.append(n.key)
-                st.add(n.key)
+        for key, value in live:
+            lst, st = x.setdefault(key.lower(), ([], set()))
+            if key not in st:
+                lst.append(key)
+                st.add(key)
         self.assertEqual(dict(d._casemap), x)
 
     def omd(self, *args, **kwargs):
         return pathfinder.util.CaseInsensitiveOrderedMultiDict(*args, **kwargs)
 
 
+class ChainedMultiDictTests(unittest.TestCase):
+    def chain(self):
+        return pathfinder.util.ChainedMultiDict(
+                pathfinder.util.OrderedMultiDict([('a', 1), ('b', 2)]),
+                pathfinder.util.OrderedMultiDict([('c', 3), ('a', 4)]))
+
+    def test_reads_like_merged_copy(self):
+        c = self.chain()
+        merged = c._omds[0].copy()
+        merged.update(c._omds[1])
+        self.assertEqual(len(c), len(merged))
+        self.assertEqual(list(c), list(merged))
+        self.assertEqual(c.items(), merged.items())
+        self.assertEqual(c.keys(), merged.keys())
+        self.assertEqual(c.values(), merged.values())
+        self.assertEqual(c.lastitems(), merged.lastitems())
+        self.assertEqual(c.getall('a'), merged.getall('a'))
+        self.assertEqual(c['a'], 4)
+        self.assertEqual(c['b'], 2)
+        self.assertEqual(c.get('d', 5), 5)
+        self.assertIn('c', c)
+        self.assertNotIn('d', c)
+        self.assertRaises(KeyError, lambda: c['d'])
+        self.assertEqual(c.copy().items(), merged.items())
+
+    def test_read_only(self):
+        c = self.chain()
+        def set_item():
+            c['d'] = 5
+        self.assertRaises(TypeError, set_item)
+
+    def test_live(self):
+        c = self.chain()
+        c._omds[1]['b'] = 6
+        self.assertEqual(c['b'], 6)
+
+
+class FrozenCIMDTests(unittest.TestCase):
+    pairs = [('a', 1), ('B', 2), ('A', 3), ('c', 4), ('b', 5)]
+
+    def fcimd(self, pairs=pairs):
+        return pathfinder.util.FrozenCaseInsensitiveMultiDict(pairs)
+
+    def test_reads(self):
+        d = self.fcimd()
+        self.assertEqual(len(d), 5)
+        self.assertEqual(list(d), ['a', 'B', 'A', 'c', 'b'])
+        self.assertEqual(d.items(), self.pairs)
+        self.assertEqual(d.keys(), ['a', 'B', 'A', 'c', 'b'])
+        self.assertEqual(d.values(), [1, 2, 3, 4, 5])
+        self.assertEqual(dict(self.fcimd({'x': 1, 'y': 2})), {'x': 1, 'y': 2})
+
+    def test_insensitive_lookups(self):
+        d = self.fcimd()
+        self.assertIn('C', d)
+        self.assertNotIn('d', d)
+        self.assertEqual(d['a'], 3)
+        self.assertEqual(d['b'], 5)
+        self.assertEqual(d.get('C'), 4)
+        self.assertEqual(d.get('D', 6), 6)
+        self.assertRaises(KeyError, lambda: d['d'])
+        self.assertEqual(d.getall('b'), [2, 5])
+        self.assertEqual(list(d.itergetall('A')), [1, 3])
+        self.assertEqual(d.getall('d'), [])
+
+    def test_immutable(self):
+        d = self.fcimd()
+        def set_item():
+            d['d'] = 6
+        self.assertRaises(TypeError, set_item)
+        self.assertFalse(hasattr(d, 'pop'))
+
+    def test_hashable(self):
+        self.assertEqual(hash(self.fcimd()), hash(self.fcimd()))
+        self.assertEqual(self.fcimd(), self.fcimd())
+        self.assertNotEqual(self.fcimd(), self.fcimd(self.pairs[:-1]))
+        self.assertEqual(len(set([self.fcimd(), self.fcimd()])), 1)
+
+    def test_copy_is_mutable(self):
+        c = self.fcimd().copy()
+        c['d'] = 6
+        self.assertEqual(c.items(), self.pairs + [('d', 6)])
+
+
+class HeaderNameTests(unittest.TestCase):
+    def test_spellings_share_one_lowercase_name(self):
+        names = pathfinder.util.lower_header_names
+        lower = names['Content-Type']
+        self.assertEqual(lower, 'content-type')
+        self.assertIs(names['content-type'], lower)
+        self.assertIs(names['ETag'], names['Etag'])
+        self.assertIs(
+                pathfinder.util.environ_header_names['HTTP_CONTENT_TYPE'],
+                lower)
+
+    def test_indexes_use_the_interned_names(self):
+        names = pathfinder.util.lower_header_names
+        d = pathfinder.util.FrozenCaseInsensitiveMultiDict(
+                [('Content-Type', 'text/plain'), ('X-Thing', '1')])
+        key, = [k for k in d._index if k == 'content-type']
+        self.assertIs(key, names['Content-Type'])
+        self.assertEqual(d['CONTENT-TYPE'], 'text/plain')
+        self.assertEqual(d['x-thing'], '1')
+
+        c = pathfinder.util.CaseInsensitiveOrderedMultiDict()
+        c['Content-Length'] = '5'
+        c['X-Thing'] = '1'
+        key, = [k for k in c._casemap if k == 'content-length']
+        self.assertIs(key, names['Content-Length'])
+        self.assertEqual(c['content-length'], '5')
+        self.assertEqual(c['CONTENT-LENGTH'], '5')
+        self.assertEqual(c.getall('x-THING'), ['1'])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# vim: fileencoding=utf8:et:sta:ai:sw=4:ts=4:sts=4
+
+import random
+import string
+import unittest
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+import pathfinder.multipart
+
+
+BOUNDARY_CHARS = string.ascii_letters + string.digits + "'()+_,-./:=?"
+
+
+#
+# corpus generation, shared with test/bench/bench_multipart.py
+#
+def make_data(rng, size, newline_density):
+    "random bytes with CR, LF, CRLF and '--' sprinkled in at the density"
+    block = []
+    for i in xrange(min(size, 4096)):
+        if rng.random() < newline_density:
+            block.append(rng.choice(["\r\n", "\n", "\r", "\r\n--"]))
+        else:
+            block.append(chr(rng.randrange(256)))
+    block = "".join(block)
+    if not block:
+        return ""
+    return (block * (size // len(block) + 1))[:size]
+
+
+def make_message(rng, part_count, part_size, boundary_length,
+        newline_density):
+    """build a multipart body
+
+    returns the boundary, the body and a list of the (headerlist, data)
+    pairs a parser should produce
+    """
+    boundary = "".join(
+            rng.choice(BOUNDARY_CHARS) for i in xrange(boundary_length))
+    delimiter = "\r\n--" + boundary
+    chunks, expected = [], []
+    for i in xrange(part_count):
+        data = make_data(rng, part_size, newline_density)
+        while delimiter in data:
+            data = data.replace(delimiter, "\r\n-")
+        headers = [('Content-Disposition',
+            'form-data; name="field%d"; filename="file%d.bin"' % (i, i))]
+        if rng.random() < 0.5:
+            headers.append(('Content-Type', 'application/octet-stream'))
+        chunks.append("--%s\r\n%s\r\n\r\n%s\r\n" % (boundary,
+            "\r\n".join("%s: %s" % pair for pair in headers), data))
+        expected.append((headers, data))
+    chunks.append("--%s--\r\n" % boundary)
+    return boundary, "".join(chunks), expected
+
+
+def reference_parse(body, boundary):
+    "the obvious, slow, entirely in-memory split of a multipart body"
+    segments = ("\r\n" + body).split("\r\n--" + boundary)
+    results = []
+    for segment in segments[1:]:
+        if segment.startswith("--"):
+            break
+        head, data = segment[2:].split("\r\n\r\n", 1)
+        headers = [tuple(x.strip() for x in line.split(":", 1))
+                for line in head.split("\r\n")]
+        results.append((headers, data))
+    return results
+
+
+class ChunkedStream(object):
+    "a stream returning short reads of random sizes"
+    def __init__(self, rng, data):
+        self.rng = rng
+        self.data = StringIO(data)
+
+    def read(self, size):
+        return self.data.read(self.rng.randint(1, size))
+
+
+class MultipartFuzzTests(unittest.TestCase):
+    ROUNDS = 200
+
+    def random_message(self, rng):
+        return make_message(rng,
+                part_count=rng.randint(1, 5),
+                part_size=rng.choice([0, 1, 2, 10, 100, 1000, 5000]),
+                boundary_length=rng.randint(1, 70),
+                newline_density=rng.choice([0, 0.01, 0.1, 0.5, 1]))
+
+    def pull_parse(self, rng, body, boundary):
+        parser = pathfinder.multipart.MultipartParser(
+                ChunkedStream(rng, body), boundary, len(body),
+                buffer_size=rng.randint(300, 5000),
+                memfile_limit=rng.choice([0, 100, 2**18]))
+        return [(p.headerlist, p.file.read()) for p in parser]
+
+    def push_parse(self, rng, body, boundary):
+        parser = pathfinder.multipart.MultipartPushParser(boundary)
+        results = []
+        pos = 0
+        while pos < len(body):
+            size = rng.randint(1, 2 * len(boundary) + 10)
+            for event, part, data in parser.feed(body[pos:pos + size]):
+                if event == pathfinder.multipart.PART_START:
+                    results.append((part.headerlist, []))
+                elif event == pathfinder.multipart.PART_DATA:
+                    results[-1][1].append(data)
+            pos += size
+        parser.close()
+        return [(headers, "".join(data)) for headers, data in results]
+
+    def test_differential(self):
+        rng = random.Random(2013)
+        for i in xrange(self.ROUNDS):
+            boundary, body, expected = self.random_message(rng)
+            self.assertEqual(reference_parse(body, boundary), expected)
+            self.assertEqual(self.pull_parse(rng, body, boundary), expected)
+            self.assertEqual(self.push_parse(rng, body, boundary), expected)
+
+    def test_truncated_messages_raise(self):
+        rng = random.Random(2014)
+        for i in xrange(self.ROUNDS):
+            boundary, body, expected = self.random_message(rng)
+            body = body[:rng.randrange(len(body) - len(boundary) - 4)]
+            self.assertRaises(pathfinder.multipart.MultipartError,
+                    self.pull_parse, rng, body, boundary)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,38 @@
 #!/usr/bin/env python
 # vim: fileencoding=utf8:et:sta:ai:sw=4:ts=4:sts=4
 
+import copy
+import os
+import pickle
+import shutil
+import tempfile
 import unittest
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
 
 import pathfinder.multipart
 
 
+def build_multipart(boundary, parts):
+    chunks = []
+    for name, filename, body in parts:
+        disposition = 'form-data; name="%s"' % name
+        if filename:
+            disposition += '; filename="%s"' % filename
+        chunks.append("--%s\r\nContent-Disposition: %s\r\n\r\n%s\r\n" % (
+            boundary, disposition, body))
+    chunks.append("--%s--\r\n" % boundary)
+    return "".join(chunks)
+
+
+def parse_multipart(body, boundary, **kwargs):
+    parser = pathfinder.multipart.MultipartParser(
+            StringIO(body), boundary, len(body), **kwargs)
+    return parser.parts()
+
+
 class HeaderParsingTests(unittest.TestCase):
     def test_option_header_urlencoded_ctype_no_charset(self):
         self.assertEqual(
@@ -27,6 +54,243 @@ class HeaderParsingTests(unittest.TestCase):
                     "application/x-form-url-encoded; charset=UTF8"),
                 ('application/x-form-url-encoded', {'charset': 'UTF8'}))
 
+    def test_option_header_normalizes_value(self):
+        self.assertEqual(
+                pathfinder.multipart.parse_options_header(
+                    " Multipart/Form-Data ; boundary=XyZ"),
+                ('multipart/form-data', {'boundary': 'XyZ'}))
+
+    def test_option_header_cached_and_immutable(self):
+        header = "text/plain; charset=latin1"
+        first = pathfinder.multipart.parse_options_header(header)
+        self.assertIs(pathfinder.multipart.parse_options_header(header), first)
+        def mutate():
+            first[1]['charset'] = 'utf8'
+        self.assertRaises(TypeError, mutate)
+        self.assertRaises(TypeError, first[1].update, {})
+
+    def test_option_header_copyable(self):
+        ctype, opts = pathfinder.multipart.parse_options_header(
+                "text/plain; charset=latin1")
+        for copied in (copy.copy(opts), copy.deepcopy(opts),
+                pickle.loads(pickle.dumps(opts, 2))):
+            self.assertEqual(copied, {'charset': 'latin1'})
+            copied['charset'] = 'utf8'
+        self.assertEqual(opts, {'charset': 'latin1'})
+
+    def test_option_header_merges_into_options(self):
+        options = {'a': '1'}
+        ctype, opts = pathfinder.multipart.parse_options_header(
+                "text/plain; charset=latin1", options)
+        self.assertIs(opts, options)
+        self.assertEqual(opts, {'a': '1', 'charset': 'latin1'})
+
+    def test_option_header_cache_bounded(self):
+        for i in xrange(pathfinder.multipart._options_cache_size + 10):
+            pathfinder.multipart.parse_options_header(
+                    "text/plain; x=%d" % i)
+        self.assertTrue(len(pathfinder.multipart._options_cache) <=
+                pathfinder.multipart._options_cache_size)
+
+    def test_option_header_unique_values_uncached(self):
+        cache = pathfinder.multipart._options_cache
+        cache.clear()
+        for header in ("multipart/form-data; boundary=xyz",
+                'form-data; name="f"; Filename="a.txt"',
+                "text/plain; x=%s" % ("y" * 300)):
+            ctype, opts = pathfinder.multipart.parse_options_header(header)
+            self.assertRaises(TypeError, opts.update, {})
+            self.assertNotIn(header, cache)
+        pathfinder.multipart.parse_options_header('form-data; name="f"')
+        self.assertEqual(len(cache), 1)
+
+
+class MultipartParsingTests(unittest.TestCase):
+    def test_simple_fields(self):
+        body = build_multipart("xyz", [("a", None, "1"), ("b", None, "two")])
+        parts = parse_multipart(body, "xyz")
+        self.assertEqual([p.name for p in parts], ["a", "b"])
+        self.assertEqual([p.value for p in parts], [u"1", u"two"])
+
+    def test_file_part(self):
+        body = build_multipart("xyz", [("f", "x.bin", "\x00\x01\r\n\x02")])
+        part, = parse_multipart(body, "xyz")
+        self.assertEqual(part.filename, "x.bin")
+        self.assertEqual(part.file.read(), "\x00\x01\r\n\x02")
+
+    def test_lf_line_endings(self):
+        body = build_multipart("xyz", [("a", None, "1\r"), ("f", "x.bin",
+            "\r\n\r\n")]).replace("\r\n", "\n")
+        self.assertEqual(body.count("\r"), 1)
+        for size in (48, len(body)):
+            a, f = parse_multipart(body, "xyz", buffer_size=size)
+            self.assertEqual(a.value, u"1")
+            self.assertEqual(f.file.read(), "\n\n")
+        parser = pathfinder.multipart.MultipartPushParser("xyz")
+        data = []
+        for byte in body:
+            data.extend(d for e, p, d in parser.feed(byte)
+                    if e == pathfinder.multipart.PART_DATA)
+        parser.close()
+        self.assertEqual("".join(data), "1\n\n")
+
+    def test_newline_heavy_body(self):
+        data = "\r\n\n\r--xy\r\n--xyz" * 1000
+        body = build_multipart("xyzzy", [("f", "x.bin", data)])
+        part, = parse_multipart(body, "xyzzy")
+        self.assertEqual(part.file.read(), data)
+        self.assertEqual(part.size, len(data))
+
+    def test_delimiter_split_across_reads(self):
+        data = "a" * 100
+        body = build_multipart("boundary", [("a", None, data), ("b", None, "")])
+        for size in range(48, 112):
+            parts = parse_multipart(body, "boundary", buffer_size=size)
+            self.assertEqual([p.file.read() for p in parts], [data, ""])
+
+    def test_leading_blank_lines(self):
+        body = "\r\n\r\n" + build_multipart("xyz", [("a", None, "1")])
+        part, = parse_multipart(body, "xyz")
+        self.assertEqual(part.value, u"1")
+
+    def test_missing_first_boundary(self):
+        body = "junk" + build_multipart("xyz", [("a", None, "1")])
+        self.assertRaises(pathfinder.multipart.MultipartError,
+                parse_multipart, body, "xyz")
+
+    def test_missing_terminator(self):
+        body = build_multipart("xyz", [("a", None, "1")])[:-9]
+        self.assertRaises(pathfinder.multipart.MultipartError,
+                parse_multipart, body, "xyz")
+
+    def test_spools_to_disk(self):
+        data = "z" * 1000
+        body = build_multipart("xyz", [("f", "x.bin", data)])
+        part, = parse_multipart(body, "xyz", memfile_limit=100)
+        self.assertFalse(part.is_buffered())
+        self.assertEqual(part.file.read(), data)
+
+    def test_spool_by_content_length(self):
+        body = build_multipart("xyz", [
+            ("a", None, "1"), ("f", "x.bin", "small")])
+        a, f = parse_multipart(body, "xyz", memfile_limit=100)
+        self.assertTrue(a.is_buffered())
+        self.assertFalse(f.is_buffered())
+        self.assertEqual(f.value, "small")
+
+        body = body.replace('name="a"', 'name="a"\r\nContent-Length: 1000')
+        a, f = parse_multipart(body, "xyz", memfile_limit=100)
+        self.assertFalse(a.is_buffered())
+        self.assertEqual(a.value, "1")
+        self.assertEqual(os.fstat(a.file.fileno()).st_size, 1)
+
+    def test_spool_directory(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            body = build_multipart("xyz", [("f", "x.bin", "z" * 1000)])
+            part, = parse_multipart(body, "xyz",
+                    memfile_limit=100, tmpdir=tmpdir)
+            self.assertEqual(os.path.dirname(part.file.name), tmpdir)
+            part.file.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_save_as(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            body = build_multipart("xyz", [
+                ("a", None, "small"), ("f", "x.bin", "z" * 1000)])
+            small, big = parse_multipart(body, "xyz", memfile_limit=100)
+            for i, part in enumerate([small, big, small, big]):
+                path = os.path.join(tmpdir, str(i))
+                self.assertEqual(part.save_as(path, link=i > 1), part.size)
+                self.assertEqual(open(path, 'rb').read(), part.value)
+            self.assertEqual(os.stat(big.file.name).st_nlink, 2)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_getbuffer(self):
+        data = "\x00\x01" * 500
+        body = build_multipart("xyz", [
+            ("a", None, "small"), ("e", None, ""), ("f", "x.bin", data)])
+        small, empty, big = parse_multipart(body, "xyz", memfile_limit=100)
+        self.assertEqual(small.getbuffer().tobytes(), "small")
+        self.assertEqual(empty.getbuffer().tobytes(), "")
+        buf = big.getbuffer()
+        try:
+            self.assertEqual(len(buf), 1000)
+            self.assertEqual(buf[10:14], "\x00\x01\x00\x01")
+            self.assertEqual(buf[:], data)
+        finally:
+            buf.close()
+
+    def test_memory_limit(self):
+        body = build_multipart("xyz", [("f", "x.bin", "z" * 1000)])
+        self.assertRaises(pathfinder.multipart.MultipartError,
+                parse_multipart, body, "xyz", mem_limit=100)
+
+
+class MemoryBudgetTests(unittest.TestCase):
+    def test_acquire_release(self):
+        budget = pathfinder.multipart.MemoryBudget(10)
+        budget.acquire(6)
+        self.assertRaises(pathfinder.multipart.MultipartLimitError,
+                budget.acquire, 6)
+        budget.release(6)
+        budget.acquire(10)
+        self.assertEqual(budget.used, 10)
+
+    def test_parser_charges_budget(self):
+        budget = pathfinder.multipart.MemoryBudget(500)
+        body = build_multipart("xyz", [("f", "x.bin", "z" * 1000)])
+        self.assertRaises(pathfinder.multipart.MultipartLimitError,
+                parse_multipart, body, "xyz", budget=budget)
+        self.assertEqual(budget.used, 0)
+        parse_multipart(body, "xyz", budget=budget, memfile_limit=100)
+        self.assertEqual(budget.used, 0)
+
+
+class MultipartPushParsingTests(unittest.TestCase):
+    def feed_all(self, parser, chunks):
+        events = []
+        for chunk in chunks:
+            for event, part, data in parser.feed(chunk):
+                events.append((event, part.name, data))
+        parser.close()
+        return events
+
+    def test_events(self):
+        body = build_multipart("xyz", [("a", None, "1"), ("b", "b.txt", "22")])
+        parser = pathfinder.multipart.MultipartPushParser("xyz")
+        self.assertEqual(self.feed_all(parser, [body]), [
+            (pathfinder.multipart.PART_START, "a", None),
+            (pathfinder.multipart.PART_DATA, "a", "1"),
+            (pathfinder.multipart.PART_END, "a", None),
+            (pathfinder.multipart.PART_START, "b", None),
+            (pathfinder.multipart.PART_DATA, "b", "22"),
+            (pathfinder.multipart.PART_END, "b", None)])
+        self.assertTrue(parser.done)
+
+    def test_byte_at_a_time(self):
+        data = "\r\n--xy\r\n" * 10
+        body = build_multipart("xyz", [("a", None, data), ("b", None, "")])
+        parser = pathfinder.multipart.MultipartPushParser("xyz")
+        events = self.feed_all(parser, list(body))
+        self.assertEqual(
+                "".join(d for e, n, d in events
+                    if e == pathfinder.multipart.PART_DATA),
+                data)
+        self.assertEqual(
+                [n for e, n, d in events
+                    if e == pathfinder.multipart.PART_END],
+                ["a", "b"])
+
+    def test_close_incomplete(self):
+        body = build_multipart("xyz", [("a", None, "1")])
+        parser = pathfinder.multipart.MultipartPushParser("xyz")
+        parser.feed(body[:-10])
+        self.assertRaises(pathfinder.multipart.MultipartError, parser.close)
+
 
 if __name__ == '__main__':
     unittest.main()